@@ -13,6 +13,7 @@ gi.require_version('Soup', '3.0')
 gi.require_version('WebKit', '6.0')
 from gi.repository import GLib, Gio, Gdk, Gtk, Adw, WebKit
 
+from wike import thumbnails, wikipedia
 from wike.data import settings, languages, history, bookmarks
 from wike.prefs import PrefsDialog
 from wike.window import Window
@@ -79,6 +80,10 @@ class Application(Adw.Application):
     action.connect('activate', self._about_cb)
     self.add_action(action)
 
+    action = Gio.SimpleAction.new('request-stats', None)
+    action.connect('activate', self._request_stats_cb)
+    self.add_action(action)
+
     action = Gio.SimpleAction.new('quit', None)
     action.connect('activate', self._quit_cb)
     self.add_action(action)
@@ -158,6 +163,11 @@ class Application(Adw.Application):
 
     about_dialog.present(self._window)
 
+  # Print summary of last API requests (debug action)
+
+  def _request_stats_cb(self, action, parameter):
+    print(wikipedia.format_request_stats())
+
   # On window close quit app
 
   def _window_close_cb(self, window):
@@ -197,15 +207,24 @@ class Application(Adw.Application):
 
     if not settings.get_boolean('keep-history'):
       history.clear()
+      wikipedia.redirect_map.clear()
 
     if settings.get_boolean('clear-data'):
       data_manager = network_session.get_website_data_manager()
       data_manager.clear(WebKit.WebsiteDataTypes.ALL, 0, None, None, None)
+      wikipedia.properties_cache.clear()
+      wikipedia.suggestion_cache.clear()
+      wikipedia.redirect_map.clear()
+      thumbnails.clear()
 
     settings.sync()
     languages.save()
-    history.save()
     bookmarks.save()
+    wikipedia.random_pool.save()
+    wikipedia.redirect_map.save()
+
+    if wikipedia.request_stats:
+      print(wikipedia.format_request_stats())
 
     self.quit()
 
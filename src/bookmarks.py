@@ -163,7 +163,7 @@ class BookmarksPanel(Adw.Bin):
     else:
       bookmarks_items = bookmarks.items
 
-    if self._window.page.wikiview.get_base_uri() in bookmarks_items:
+    if self._window.page.wikiview.get_canonical_uri() in bookmarks_items:
       add_bookmark_action.set_enabled(False)
     else:
       add_bookmark_action.set_enabled(True)
@@ -0,0 +1,523 @@
+# This file is part of Wike (com.github.hugolabe.Wike)
+# SPDX-FileCopyrightText: 2021-25 Hugo Olabera
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+
+import os, json, time, hashlib, sqlite3
+from collections import OrderedDict
+
+
+# In-memory LRU cache with time to live for API responses (expired items
+# are kept for a while to be served as stale)
+
+class ResponseCache:
+
+  # Set size limits and initialize counters
+
+  def __init__(self, max_entries, max_bytes, max_stale=0):
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self.max_stale = max_stale
+    self.size = 0
+    self.hits = 0
+    self.stale_hits = 0
+    self.misses = 0
+    self._items = OrderedDict()
+
+  # Get data for key if cached and not expired
+
+  def get(self, key):
+    if key in self._items:
+      data, expires = self._items[key]
+      now = time.monotonic()
+      if expires > now:
+        self._items.move_to_end(key)
+        self.hits += 1
+        return data
+      elif expires + self.max_stale <= now:
+        self._remove(key)
+
+    self.misses += 1
+    return None
+
+  # Get data for key only if expired but not older than stale limit
+
+  def get_stale(self, key):
+    if key in self._items:
+      data, expires = self._items[key]
+      if expires <= time.monotonic() < expires + self.max_stale:
+        self._items.move_to_end(key)
+        self.stale_hits += 1
+        return data
+
+    return None
+
+  # Store data for key and evict least recently used items over limits
+
+  def put(self, key, data, ttl):
+    if len(data) > self.max_bytes:
+      return
+
+    if key in self._items:
+      self._remove(key)
+
+    self._items[key] = (data, time.monotonic() + ttl)
+    self.size += len(data)
+
+    while len(self._items) > self.max_entries or self.size > self.max_bytes:
+      oldest_key = next(iter(self._items))
+      self._remove(oldest_key)
+
+  # Remove items with keys starting with prefix (all items if empty)
+
+  def invalidate(self, prefix=''):
+    if prefix == '':
+      self._items.clear()
+      self.size = 0
+      return
+
+    for key in [key for key in self._items if key.startswith(prefix)]:
+      self._remove(key)
+
+  # Get cache counters and sizes
+
+  def stats(self):
+    return { 'hits': self.hits,
+             'stale_hits': self.stale_hits,
+             'misses': self.misses,
+             'entries': len(self._items),
+             'bytes': self.size }
+
+  # Remove item and update size
+
+  def _remove(self, key):
+    data, expires = self._items.pop(key)
+    self.size -= len(data)
+
+
+# Disk cache for article properties with one json file per (lang, title)
+
+class PropertiesCache:
+
+  _prune_interval = 50
+
+  # Set cache directory and size limit
+
+  def __init__(self, path, max_entries):
+    self._path = path
+    self.max_entries = max_entries
+    self._puts = 0
+
+  # Get stored properties for article
+
+  def get(self, lang, title):
+    try:
+      with open(self._file_path(lang, title), 'r') as file:
+        return json.load(file)
+    except:
+      return None
+
+  # Store properties for article (write to temp file and replace)
+
+  def put(self, lang, title, props):
+    file_path = self._file_path(lang, title)
+    temp_path = file_path + '.' + str(os.getpid()) + '.tmp'
+
+    try:
+      os.makedirs(self._path, exist_ok=True)
+      with open(temp_path, 'w') as file:
+        json.dump(props, file)
+      os.replace(temp_path, file_path)
+    except:
+      print('Can’t write properties cache file')
+      return
+
+    self._puts += 1
+    if self._puts % self._prune_interval == 1:
+      self._prune()
+
+  # Remove stored properties for article
+
+  def remove(self, lang, title):
+    try:
+      os.remove(self._file_path(lang, title))
+    except:
+      pass
+
+  # Remove all stored properties
+
+  def clear(self):
+    for file_path in self._list_files():
+      try:
+        os.remove(file_path)
+      except:
+        pass
+
+  # Get file path for article key
+
+  def _file_path(self, lang, title):
+    key = hashlib.sha1((lang + ':' + title).encode('utf-8')).hexdigest()
+    return os.path.join(self._path, key + '.json')
+
+  # List cache files
+
+  def _list_files(self):
+    try:
+      return [entry.path for entry in os.scandir(self._path) if entry.name.endswith('.json')]
+    except:
+      return []
+
+  # Remove least recently written files over size limit
+
+  def _prune(self):
+    files = self._list_files()
+    if len(files) <= self.max_entries:
+      return
+
+    files.sort(key=os.path.getmtime)
+    for file_path in files[:len(files) - self.max_entries]:
+      try:
+        os.remove(file_path)
+      except:
+        pass
+
+
+# Disk cache for binary data with one file per key (least recently written
+# files removed over size limit)
+
+class FileCache:
+
+  _prune_interval = 50
+
+  # Set cache directory and size limit
+
+  def __init__(self, path, max_files):
+    self._path = path
+    self.max_files = max_files
+    self._puts = 0
+
+  # Get data stored for key
+
+  def get(self, key):
+    try:
+      with open(self._file_path(key), 'rb') as file:
+        return file.read()
+    except:
+      return None
+
+  # Get path of file stored for key (None if not stored)
+
+  def get_path(self, key):
+    file_path = self._file_path(key)
+    if os.path.isfile(file_path):
+      return file_path
+    else:
+      return None
+
+  # Store data for key (write to temp file and replace)
+
+  def put(self, key, data):
+    file_path = self._file_path(key)
+    temp_path = file_path + '.' + str(os.getpid()) + '.tmp'
+
+    try:
+      os.makedirs(self._path, exist_ok=True)
+      with open(temp_path, 'wb') as file:
+        file.write(data)
+      os.replace(temp_path, file_path)
+    except:
+      print('Can’t write cache file')
+      return
+
+    self._puts += 1
+    if self._puts % self._prune_interval == 1:
+      self._prune()
+
+  # Remove all stored data
+
+  def clear(self):
+    for file_path in self._list_files():
+      try:
+        os.remove(file_path)
+      except:
+        pass
+
+  # Get file path for key
+
+  def _file_path(self, key):
+    return os.path.join(self._path, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+  # List cache files
+
+  def _list_files(self):
+    try:
+      return [entry.path for entry in os.scandir(self._path) if not entry.name.endswith('.tmp')]
+    except:
+      return []
+
+  # Remove least recently written files over size limit
+
+  def _prune(self):
+    files = self._list_files()
+    if len(files) <= self.max_files:
+      return
+
+    files.sort(key=os.path.getmtime)
+    for file_path in files[:len(files) - self.max_files]:
+      try:
+        os.remove(file_path)
+      except:
+        pass
+
+
+# Disk cache for search suggestions by language and normalized query, with
+# the limit of results requested (SQLite database shared between processes)
+
+class SuggestionCache:
+
+  _prune_interval = 100
+
+  # Set database file path, limits and time results are fresh (database is
+  # opened on first use)
+
+  def __init__(self, file_path, max_entries, max_age, ttl):
+    self._file_path = file_path
+    self.max_entries = max_entries
+    self.max_age = max_age
+    self.ttl = ttl
+    self._connection = None
+    self._puts = 0
+
+  # Get stored results (up to limit) and their age in seconds for query
+  # (None if not stored, too old or stored with a lower limit)
+
+  def get(self, lang, query, limit):
+    connection = self._connect()
+    if not connection:
+      return None
+
+    try:
+      row = connection.execute('SELECT max_results, results, time FROM suggestions WHERE lang = ? AND query = ?',
+                               (lang, _normalize(query))).fetchone()
+    except sqlite3.Error:
+      return None
+
+    if not row:
+      return None
+
+    max_results, results, stored_time = row
+    age = time.time() - stored_time
+    if age > self.max_age:
+      return None
+
+    results = json.loads(results)
+    if limit > max_results and len(results) >= max_results:
+      return None
+
+    return results[:limit], age
+
+  # Store results for query (not replacing fresh results stored with a
+  # higher limit) and remove old ones from time to time
+
+  def put(self, lang, query, limit, results):
+    connection = self._connect()
+    if not connection:
+      return
+
+    try:
+      with connection:
+        connection.execute('''INSERT INTO suggestions VALUES (?, ?, ?, ?, ?)
+                              ON CONFLICT (lang, query) DO UPDATE SET
+                              max_results = excluded.max_results, results = excluded.results, time = excluded.time
+                              WHERE excluded.max_results >= suggestions.max_results OR suggestions.time < ?''',
+                           (lang, _normalize(query), limit, json.dumps(results), time.time(), time.time() - self.ttl))
+    except sqlite3.Error:
+      print('Can’t write suggestions cache')
+      return
+
+    self._puts += 1
+    if self._puts % self._prune_interval == 1:
+      self._prune()
+
+  # Remove all stored results
+
+  def clear(self):
+    connection = self._connect()
+    if not connection:
+      return
+
+    try:
+      with connection:
+        connection.execute('DELETE FROM suggestions')
+    except sqlite3.Error:
+      print('Can’t clear suggestions cache')
+
+  # Open database with write-ahead log for concurrent access and create
+  # table if needed (False if database can't be opened)
+
+  def _connect(self):
+    if self._connection is None:
+      try:
+        os.makedirs(os.path.dirname(self._file_path), exist_ok=True)
+        connection = sqlite3.connect(self._file_path, timeout=2)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('''CREATE TABLE IF NOT EXISTS suggestions (
+                              lang TEXT NOT NULL,
+                              query TEXT NOT NULL,
+                              max_results INTEGER NOT NULL,
+                              results TEXT NOT NULL,
+                              time REAL NOT NULL,
+                              PRIMARY KEY (lang, query))''')
+        connection.execute('CREATE INDEX IF NOT EXISTS suggestions_time ON suggestions (time)')
+      except (sqlite3.Error, OSError):
+        print('Can’t open suggestions cache')
+        self._connection = False
+      else:
+        self._connection = connection
+
+    return self._connection
+
+  # Remove results too old or over size limit
+
+  def _prune(self):
+    try:
+      with self._connection:
+        self._connection.execute('DELETE FROM suggestions WHERE time < ?', (time.time() - self.max_age,))
+        self._connection.execute('DELETE FROM suggestions WHERE rowid IN (SELECT rowid FROM suggestions ORDER BY time DESC LIMIT -1 OFFSET ?)',
+                                 (self.max_entries,))
+    except sqlite3.Error:
+      pass
+
+
+# Pool of prefetched random article uris for each language (json file)
+
+class RandomPool:
+
+  # Set file path and size limit (file is loaded on first use)
+
+  def __init__(self, file_path, max_items):
+    self._file_path = file_path
+    self.max_items = max_items
+    self._items = None
+    self._changed = False
+
+  # Take first uri from pool for language
+
+  def pop(self, lang):
+    items = self._get_items().get(lang)
+    if items:
+      self._changed = True
+      return items.pop(0)
+    else:
+      return None
+
+  # Add new uris to pool for language
+
+  def extend(self, lang, uris):
+    items = self._get_items().setdefault(lang, [])
+    for uri in uris:
+      if not uri in items:
+        items.append(uri)
+    del items[self.max_items:]
+    self._changed = True
+
+  # Get number of uris in pool for language
+
+  def count(self, lang):
+    return len(self._get_items().get(lang, []))
+
+  # Save json pool file if changed
+
+  def save(self):
+    if not self._changed:
+      return
+
+    with open(self._file_path, 'w') as file:
+      json.dump(self._items, file)
+    self._changed = False
+
+  # Get items loading json pool file if needed
+
+  def _get_items(self):
+    if self._items is None:
+      try:
+        with open(self._file_path, 'r') as file:
+          self._items = json.load(file)
+      except:
+        self._items = {}
+
+    return self._items
+
+
+# Map of redirects from source uri to target uri with age limit (json file)
+
+class RedirectMap:
+
+  # Set file path and limits (file is loaded on first use)
+
+  def __init__(self, file_path, max_items, max_age):
+    self._file_path = file_path
+    self.max_items = max_items
+    self.max_age = max_age
+    self._items = None
+    self._changed = False
+
+  # Get target for source uri if known and not too old
+
+  def get(self, uri):
+    item = self._get_items().get(uri)
+    if item and item[1] + self.max_age > time.time():
+      return item[0]
+    else:
+      return None
+
+  # Add redirect and remove oldest items over size limit
+
+  def put(self, source, target):
+    items = self._get_items()
+    items.pop(source, None)
+    items[source] = [target, time.time()]
+
+    while len(items) > self.max_items:
+      del items[next(iter(items))]
+    self._changed = True
+
+  # Remove redirect for source uri
+
+  def remove(self, uri):
+    if self._get_items().pop(uri, None):
+      self._changed = True
+
+  # Remove all redirects
+
+  def clear(self):
+    self._items = {}
+    self._changed = True
+
+  # Save json map file if changed
+
+  def save(self):
+    if not self._changed:
+      return
+
+    with open(self._file_path, 'w') as file:
+      json.dump(self._items, file)
+    self._changed = False
+
+  # Get items loading json map file if needed
+
+  def _get_items(self):
+    if self._items is None:
+      try:
+        with open(self._file_path, 'r') as file:
+          self._items = json.load(file)
+      except:
+        self._items = {}
+
+    return self._items
+
+
+# Normalize search query for cache keys
+
+def _normalize(query):
+  return ' '.join(query.lower().split())
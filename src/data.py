@@ -3,8 +3,8 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 
-import json
-from datetime import datetime
+import os, json, sqlite3
+from datetime import datetime, timedelta
 
 from gi.repository import GLib, Gio
 
@@ -54,64 +54,202 @@ class Languages:
       json.dump(self.items, file)
 
 
-# History of recent articles
+# History of recent articles (SQLite database with one row for each article
+# visited each day, written on every visit)
 
 class History:
 
   global _data_path
-  _file_path = _data_path + '/historic.json'
+  _db_path = _data_path + '/history.db'
+  _json_path = _data_path + '/historic.json'
+  _schema_version = 1
 
-  # Load json history file
+  # Set database connection (opened on first use) and clear history if not
+  # kept
 
   def __init__(self):
     global settings
 
-    if settings.get_boolean('keep-history'):
-      try:
-        with open(self._file_path, 'r') as file:
-          self.items = json.load(file)
-      except:
-        self.items = {}
-    else:
-      self.items = {}
+    self._connection = None
+    if not settings.get_boolean('keep-history'):
+      self.clear()
 
-  # Add article to history
+  # Add article to history (replacing visit of same day)
 
   def add(self, uri, title, lang):
+    connection = self._connect()
+    if not connection:
+      return
+
     now = datetime.today()
     date = now.strftime('%Y-%m-%d')
     time = now.strftime('%H:%M:%S')
-    if date in self.items:
-      self.items[date][uri] = [time, title, lang]
-    else:
-      self.items[date] = {uri: [time, title, lang]}
+    try:
+      with connection:
+        connection.execute('''INSERT INTO history VALUES (?, ?, ?, ?, ?, ?, ?)
+                              ON CONFLICT (uri, date) DO UPDATE SET
+                              time = excluded.time, title = excluded.title, lang = excluded.lang,
+                              visited = excluded.visited, words = excluded.words''',
+                           (uri, date, time, title, lang, now.timestamp(), _title_words(title)))
+    except sqlite3.Error:
+      print('Can’t add article to history')
+
+  # Get list of date, uri, time, title and lang of articles visited (most
+  # recent first) in last days (including today) and language if given
+
+  def get_items(self, days=None, lang=None):
+    connection = self._connect()
+    if not connection:
+      return []
+
+    conditions = []
+    params = []
+    if days:
+      start = datetime.combine(datetime.today() - timedelta(days=days - 1), datetime.min.time())
+      conditions.append('visited >= ?')
+      params.append(start.timestamp())
+    if lang:
+      conditions.append('lang = ?')
+      params.append(lang)
+
+    query = 'SELECT date, uri, time, title, lang FROM history'
+    if conditions:
+      query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY visited DESC'
+
+    try:
+      return connection.execute(query, params).fetchall()
+    except sqlite3.Error:
+      return []
+
+  # Get uri and title of last articles visited in language with every term
+  # starting a word of title (most recent first, up to limit)
+
+  def find(self, terms, lang, limit):
+    connection = self._connect()
+    if not connection:
+      return []
+
+    conditions = ['lang = ?']
+    params = [lang]
+    for term in terms:
+      term = term.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+      conditions.append("words LIKE ? ESCAPE '\\'")
+      params.append('% ' + term + '%')
+    params.append(limit)
+
+    query = ('SELECT uri, title, MAX(visited) AS last FROM history WHERE ' + ' AND '.join(conditions) +
+             ' GROUP BY uri ORDER BY last DESC LIMIT ?')
+
+    try:
+      return [(uri, title) for uri, title, last in connection.execute(query, params)]
+    except sqlite3.Error:
+      return []
 
   # Remove item from history list
 
   def remove(self, date, uri):
-    item_deleted = False
-    date_deleted = False
+    connection = self._connect()
+    if not connection:
+      return False, False
 
-    if date in self.items:
-      if uri in self.items[date]:
-        del self.items[date][uri]
-        item_deleted = True
-      if len(self.items[date]) == 0:
-        del self.items[date]
-        date_deleted = True
+    try:
+      with connection:
+        item_deleted = connection.execute('DELETE FROM history WHERE uri = ? AND date = ?', (uri, date)).rowcount > 0
+      date_deleted = item_deleted and connection.execute('SELECT 1 FROM history WHERE date = ? LIMIT 1', (date,)).fetchone() is None
+    except sqlite3.Error:
+      print('Can’t remove article from history')
+      return False, False
 
     return item_deleted, date_deleted
 
   # Clear history
 
   def clear(self):
-    self.items.clear()
+    connection = self._connect()
+    if not connection:
+      return
 
-  # Save json history file
+    try:
+      with connection:
+        connection.execute('DELETE FROM history')
+    except sqlite3.Error:
+      print('Can’t clear history')
 
-  def save(self):
-    with open(self._file_path, 'w') as file:
-      json.dump(self.items, file)
+  # Open database with write-ahead log for concurrent access (search
+  # provider reads it), upgrade schema if needed and migrate json history
+  # file once (False if database can't be opened)
+
+  def _connect(self):
+    if self._connection is None:
+      try:
+        os.makedirs(os.path.dirname(self._db_path), exist_ok=True)
+        connection = sqlite3.connect(self._db_path, timeout=2)
+        connection.execute('PRAGMA journal_mode=WAL')
+        self._upgrade(connection)
+      except (sqlite3.Error, OSError):
+        print('Can’t open history database')
+        self._connection = False
+      else:
+        self._connection = connection
+        self._migrate()
+
+    return self._connection
+
+  # Upgrade database schema from version stored in user_version, locking
+  # database so app and search provider don't upgrade it at once (newer
+  # schemas written by later versions of the app are not opened)
+
+  def _upgrade(self, connection):
+    if connection.execute('PRAGMA user_version').fetchone()[0] == self._schema_version:
+      return
+
+    connection.execute('BEGIN IMMEDIATE')
+    with connection:
+      version = connection.execute('PRAGMA user_version').fetchone()[0]
+      if version > self._schema_version:
+        raise sqlite3.DatabaseError('Unknown history schema version')
+      if version < 1:
+        connection.execute('''CREATE TABLE history (
+                              uri TEXT NOT NULL,
+                              date TEXT NOT NULL,
+                              time TEXT NOT NULL,
+                              title TEXT NOT NULL,
+                              lang TEXT NOT NULL,
+                              visited REAL NOT NULL,
+                              words TEXT NOT NULL,
+                              PRIMARY KEY (uri, date))''')
+        connection.execute('CREATE INDEX history_visited ON history (visited)')
+      connection.execute('PRAGMA user_version = ' + str(self._schema_version))
+
+  # Move items from old json history file to database and remove file
+
+  def _migrate(self):
+    if not os.path.exists(self._json_path):
+      return
+
+    try:
+      with open(self._json_path, 'r') as file:
+        items = json.load(file)
+    except:
+      items = {}
+
+    rows = []
+    for date, date_items in items.items():
+      for uri, values in date_items.items():
+        time, title, lang = values
+        try:
+          visited = datetime.strptime(date + ' ' + time, '%Y-%m-%d %H:%M:%S').timestamp()
+        except ValueError:
+          continue
+        rows.append((uri, date, time, title, lang, visited, _title_words(title)))
+
+    try:
+      with self._connection:
+        self._connection.executemany('INSERT OR IGNORE INTO history VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+      os.remove(self._json_path)
+    except (sqlite3.Error, OSError):
+      print('Can’t migrate history file')
 
 
 # Lists of bookmarks
@@ -211,8 +349,23 @@ class Bookmarks:
       json.dump(self.lists, file)
 
 
-# Create global objects for languages, history and bookmarks
+# Create global objects for languages, history and bookmarks on first use
+# (so search provider loads only what it needs)
+
+_data_classes = { 'languages': Languages,
+                  'history': History,
+                  'bookmarks': Bookmarks }
+
+def __getattr__(name):
+  if name in _data_classes:
+    data_object = _data_classes[name]()
+    globals()[name] = data_object
+    return data_object
+
+  raise AttributeError('module ' + __name__ + ' has no attribute ' + name)
+
+
+# Get lowercase words of title preceded by spaces (for word prefix matching)
 
-languages = Languages()
-history = History()
-bookmarks = Bookmarks()
+def _title_words(title):
+  return ' ' + ' '.join(title.lower().split())
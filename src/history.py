@@ -3,8 +3,6 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 
-from datetime import datetime
-
 from gi.repository import GObject, Gio, Gtk, Adw, Pango
 
 from wike.data import settings, languages, history
@@ -77,35 +75,26 @@ class HistoryPanel(Adw.Bin):
     self._clear_list()
 
     history_filter = self.filter_dropdown.get_selected_item()
-    filter_days = history_filter.days
-    today = datetime.today()
-
-    for date in sorted(history.items, reverse=True):
-      delta = today - datetime.strptime(date, '%Y-%m-%d')
-      days = delta.days
-      if days >= filter_days:
-        break
+    last_date = None
+
+    for date, uri, time, title, lang in history.get_items(history_filter.days):
+      if date != last_date:
+        last_date = date
+        date_label = Gtk.Label()
+        date_label.set_label(date)
+        date_label.add_css_class('heading')
+        date_label.set_xalign(0)
+        date_label.set_margin_start(3)
+        date_label.set_margin_end(3)
+        row = Gtk.ListBoxRow()
+        row.set_child(date_label)
+        row.set_activatable(False)
+        row.set_selectable(False)
+        self.history_list.append(row)
 
-      date_label = Gtk.Label()
-      date_label.set_label(date)
-      date_label.add_css_class('heading')
-      date_label.set_xalign(0)
-      date_label.set_margin_start(3)
-      date_label.set_margin_end(3)
-      row = Gtk.ListBoxRow()
-      row.set_child(date_label)
-      row.set_activatable(False)
-      row.set_selectable(False)
+      row = HistoryRow(uri, title, lang, date, time)
       self.history_list.append(row)
-
-      history_item = history.items[date]
-      for uri in sorted(history_item, key=history_item.get, reverse=True):
-        time = history_item[uri][0]
-        title = history_item[uri][1]
-        lang = history_item[uri][2]
-        row = HistoryRow(uri, title, lang, date, time)
-        self.history_list.append(row)
-        self.selection_button.bind_property('active', row.select_check, 'visible', Gio.SettingsBindFlags.DEFAULT)
+      self.selection_button.bind_property('active', row.select_check, 'visible', Gio.SettingsBindFlags.DEFAULT)
 
   # Clear history list
 
@@ -129,7 +118,6 @@ class HistoryPanel(Adw.Bin):
 
   def clear_history(self):
     history.clear()
-    history.save()
     self._clear_list()
 
   # Settings keep history changed event
@@ -8,6 +8,7 @@ import json
 from gi.repository import GObject, Gio, Gtk, Adw, Pango
 
 from wike.data import settings, languages
+from wike.view import preconnect
 
 
 # Language links panel for sidebar
@@ -47,6 +48,7 @@ class LanglinksPanel(Adw.Bin):
 
     self.search_entry.connect('search-changed', self._search_entry_changed_cb)
     self.langlinks_list.connect('row-activated', self._list_activated_cb)
+    self.connect('map', self._panel_map_cb)
 
   # Setup filter item with a label
 
@@ -78,7 +80,7 @@ class LanglinksPanel(Adw.Bin):
     else:
       return False
 
-  # Populate langlinks list
+  # Populate langlinks list (request them if not loaded and panel is visible)
 
   def populate(self, langlinks):
     while True:
@@ -88,20 +90,23 @@ class LanglinksPanel(Adw.Bin):
       else:
         break
 
+    if langlinks is None and self.get_mapped():
+      self._window.page.wikiview.load_langlinks()
+
     if not langlinks:
       return
 
     user_langlinks = []
     other_langlinks = []
     for langlink in langlinks:
-      if langlink['lang'] in languages.items:
+      if langlink.lang in languages.items:
         user_langlinks.append(langlink)
       else:
         other_langlinks.append(langlink)
 
     if user_langlinks:
-      for langlink in sorted(user_langlinks, key=lambda x: x['lang']):
-        row = LanglinksRow(langlink['url'], langlink['lang'], langlink['autonym'].capitalize(), langlink['*'])
+      for langlink in sorted(user_langlinks, key=lambda x: x.lang):
+        row = LanglinksRow(langlink.url, langlink.lang, langlink.autonym.capitalize(), langlink.title)
         self.langlinks_list.append(row)
 
     if other_langlinks and settings.get_int('filter-langlinks') == 1:
@@ -116,10 +121,15 @@ class LanglinksPanel(Adw.Bin):
       row.set_activatable(False)
       row.set_selectable(False)
       self.langlinks_list.append(row)
-      for langlink in sorted(other_langlinks, key=lambda x: x['lang']):
-        row = LanglinksRow(langlink['url'], langlink['lang'], langlink['autonym'].capitalize(), langlink['*'])
+      for langlink in sorted(other_langlinks, key=lambda x: x.lang):
+        row = LanglinksRow(langlink.url, langlink.lang, langlink.autonym.capitalize(), langlink.title)
         self.langlinks_list.append(row)
 
+  # On panel shown load langlinks for current article
+
+  def _panel_map_cb(self, panel):
+    self._window.page.wikiview.load_langlinks()
+
   # Settings filter langlinks changed event
 
   def _filter_langlinks_changed_cb(self, settings, key):
@@ -193,9 +203,18 @@ class LanglinksRow(Gtk.ListBoxRow):
     self.lang_label.set_label(lang_name)
     self.title_label.set_label(title)
 
+    motion_controller = Gtk.EventControllerMotion.new()
+    motion_controller.connect('enter', self._motion_enter_cb)
+    self.add_controller(motion_controller)
+
     if settings.get_boolean('show-flags'):
       gfile = Gio.File.new_for_uri('resource:///com/github/hugolabe/Wike/icons/scalable/emblems/' + lang + '.svg')
       if gfile.query_exists():
         self.flag_image.set_from_icon_name(lang)
     else:
       self.flag_image.set_visible(False)
+
+  # On pointer enter warm up connection for language
+
+  def _motion_enter_cb(self, motion_controller, x, y):
+    preconnect([self.lang])
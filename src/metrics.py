@@ -0,0 +1,187 @@
+# This file is part of Wike (com.github.hugolabe.Wike)
+# SPDX-FileCopyrightText: 2021-25 Hugo Olabera
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+
+import time, urllib.parse
+from collections import deque
+
+from gi.repository import GLib
+
+
+# Timing, size, status and cache outcome of an API request (times in ms)
+
+class RequestRecord:
+
+  __slots__ = ('endpoint', 'action', 'lang', 'start', 'queue_wait', 'ttfb', 'total', 'size', 'status', 'cache')
+
+  # Set request values and start time
+
+  def __init__(self, endpoint, params):
+    self.endpoint = endpoint
+    self.action = params.get('action', '')
+    if 'generator' in params:
+      self.action += ':' + params['generator']
+    elif 'prop' in params:
+      self.action += ':' + params['prop']
+    self.lang = urllib.parse.urlparse(endpoint).netloc.split('.', 1)[0]
+    self.start = time.monotonic()
+    self.queue_wait = None
+    self.ttfb = None
+    self.total = None
+    self.size = 0
+    self.status = None
+    self.cache = 'miss'
+
+  # Set time waited in queue until request was sent
+
+  def sent(self):
+    if self.queue_wait is None:
+      self.queue_wait = (time.monotonic() - self.start) * 1000
+
+  # Set total time, response size and status
+
+  def finish(self, status, size):
+    self.total = (time.monotonic() - self.start) * 1000
+    self.status = status
+    self.size = size
+
+
+# Ring buffer of last request records with percentile summaries
+
+class RequestLog:
+
+  # Set max number of records kept
+
+  def __init__(self, max_records):
+    self._records = deque(maxlen=max_records)
+
+  # Add finished request record
+
+  def add(self, record):
+    self._records.append(record)
+
+  # Get list of records (oldest first)
+
+  def records(self):
+    return list(self._records)
+
+  # Get summary by language and action with counts by cache outcome and
+  # percentiles of times and sizes of network requests
+
+  def summary(self):
+    groups = {}
+    for record in self._records:
+      groups.setdefault((record.lang, record.action), []).append(record)
+
+    summary = {}
+    for key, records in sorted(groups.items()):
+      network = [record for record in records if record.cache == 'miss']
+      summary[key] = { 'count': len(records),
+                       'hits': _count(records, 'hit'),
+                       'stale': _count(records, 'stale'),
+                       'coalesced': _count(records, 'coalesced'),
+                       'cancelled': _count(records, 'cancelled'),
+                       'errors': len([record for record in network if record.status != 200]),
+                       'total': _percentiles([record.total for record in network]),
+                       'ttfb': _percentiles([record.ttfb for record in network]),
+                       'queue_wait': _percentiles([record.queue_wait for record in network]),
+                       'size': _percentiles([record.size for record in network]) }
+
+    return summary
+
+  # Get summary as text table
+
+  def format_summary(self):
+    lines = ['%-8s %-28s %5s %5s %5s %5s %5s %5s %20s %20s %20s %10s' % ('lang', 'action', 'count', 'hits', 'stale', 'coal',
+                                                                      'canc', 'errs', 'total p50/p90/p99', 'ttfb p50/p90/p99',
+                                                                      'wait p50/p90/p99', 'kB p50')]
+    for (lang, action), values in self.summary().items():
+      lines.append('%-8s %-28s %5d %5d %5d %5d %5d %5d %20s %20s %20s %10s' % (lang, action[:28], values['count'], values['hits'],
+                                                                            values['stale'], values['coalesced'], values['cancelled'],
+                                                                            values['errors'], _format_values(values['total']),
+                                                                            _format_values(values['ttfb']),
+                                                                            _format_values(values['queue_wait']),
+                                                                            _format_size(values['size'])))
+
+    return '\n'.join(lines)
+
+
+# Main loop lag measured as delay of a periodic timeout (time main loop was
+# blocked by callbacks, decoding or other work holding it or the GIL)
+
+class LoopLagMonitor:
+
+  # Set timeout interval (ms), max samples kept and lag counted as stall (ms)
+
+  def __init__(self, interval, max_samples, stall):
+    self.interval = interval
+    self.stall = stall
+    self.stalls = 0
+    self.max_lag = 0.0
+    self._samples = deque(maxlen=max_samples)
+    self._expected = 0
+    self._source = 0
+
+  # Start measuring
+
+  def start(self):
+    if not self._source:
+      self._expected = time.monotonic() + self.interval / 1000
+      self._source = GLib.timeout_add(self.interval, self._timeout_cb)
+
+  # Check if measuring
+
+  def is_running(self):
+    return self._source != 0
+
+  # Get summary as text
+
+  def format_summary(self):
+    values = _percentiles(self._samples)
+    return 'main loop lag p50/p90/p99 %s ms, max %.1f ms, %d stalls over %d ms' % (_format_values(values), self.max_lag,
+                                                                                   self.stalls, self.stall)
+
+  # On timeout record delay from expected time
+
+  def _timeout_cb(self):
+    now = time.monotonic()
+    lag = max((now - self._expected) * 1000, 0)
+    self._samples.append(lag)
+    self.max_lag = max(self.max_lag, lag)
+    if lag > self.stall:
+      self.stalls += 1
+
+    self._expected = now + self.interval / 1000
+    return GLib.SOURCE_CONTINUE
+
+
+# Count records with cache outcome
+
+def _count(records, cache):
+  return len([record for record in records if record.cache == cache])
+
+# Get 50, 90 and 99 percentiles of values (nearest rank, None if no values)
+
+def _percentiles(values):
+  values = sorted(value for value in values if value is not None)
+  if not values:
+    return None
+
+  return [values[min(len(values) - 1, int(len(values) * percent / 100))] for percent in (50, 90, 99)]
+
+# Get percentile times as text
+
+def _format_values(values):
+  if not values:
+    return '-'
+
+  return '/'.join(str(round(value)) for value in values)
+
+# Get median size as text in kB
+
+def _format_size(values):
+  if not values:
+    return '-'
+
+  return '%.1f' % (values[0] / 1024)
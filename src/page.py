@@ -30,6 +30,7 @@ class PageBox(Gtk.Box):
 
     self._window = window
     self.lazy_load = lazy_load
+    self._history_pending = False
 
     self.wikiview = WikiView()
     self.wikiview.set_vexpand(True)
@@ -50,6 +51,7 @@ class PageBox(Gtk.Box):
     
     self.wikiview.connect('load-changed', self._wikiview_load_changed_cb)
     self.wikiview.connect('load-props', self._wikiview_load_props_cb)
+    self.wikiview.connect('load-langlinks', self._wikiview_load_langlinks_cb)
     self.wikiview.connect('new-page', self._wikiview_new_page_cb)
     self.wikiview.connect('add-bookmark', self._wikiview_add_bookmark_cb)
     self.search_entry.connect('search-changed', self._search_entry_changed_cb, find_controller)
@@ -93,7 +95,8 @@ class PageBox(Gtk.Box):
     match event:
 
       case WebKit.LoadEvent.STARTED:
-        self._is_main = wikiview.get_uri().endswith('.wikipedia.org/')
+        self._is_main = wikiview.is_main_page()
+        self._history_pending = True
         self.search_bar.set_search_mode(False)
         self.view_stack.set_visible_child_name('wikiview')
         tabpage.set_title(_('Loading…'))
@@ -117,7 +120,9 @@ class PageBox(Gtk.Box):
         if wikiview.is_local():
           self.status.show(wikiview.get_uri())
 
-  # On wikiview load page properties populate toc and langlinks
+  # On wikiview load page properties populate toc and langlinks and add
+  # article to history (only first time for each page loaded, properties
+  # can be emitted again when refreshed)
   
   def _wikiview_load_props_cb(self, wikiview):
     tabpage = self._window.tabview.get_page(self)
@@ -130,9 +135,17 @@ class PageBox(Gtk.Box):
       self._window.bookmarks_panel.refresh_buttons()
       self._window.refresh_menu_actions(wikiview.is_local())
 
-    if settings.get_boolean('keep-history'):
+    if self._history_pending and settings.get_boolean('keep-history'):
       if not self._is_main and not wikiview.is_local():
-        self._window.history_panel.add_item(wikiview.get_base_uri(), wikiview.title, wikiview.get_lang())
+        self._window.history_panel.add_item(wikiview.get_canonical_uri(), wikiview.title, wikiview.get_lang())
+    self._history_pending = False
+
+  # On wikiview load langlinks populate langlinks panel
+
+  def _wikiview_load_langlinks_cb(self, wikiview):
+    tabpage = self._window.tabview.get_page(self)
+    if tabpage.get_selected():
+      self._window.langlinks_panel.populate(wikiview.langlinks)
 
   # On webview event create new page
 
@@ -0,0 +1,186 @@
+# This file is part of Wike (com.github.hugolabe.Wike)
+# SPDX-FileCopyrightText: 2021-25 Hugo Olabera
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+
+import time
+
+from gi.repository import GLib
+
+
+# Priority classes for requests (lower runs first)
+
+PRIORITY_FOREGROUND = 0
+PRIORITY_BACKGROUND = 1
+PRIORITY_PREFETCH = 2
+
+
+# Request waiting in scheduler queue
+
+class RequestJob:
+
+  # Set host, start function and owners with their priorities
+
+  def __init__(self, host, start, request_data, cancellable):
+    self.host = host
+    self.start = start
+    self.request_data = request_data
+    self.cancellable = cancellable
+    self.owners = {}
+    self.priority = PRIORITY_PREFETCH
+    self.retries = 0
+    self.serial = 0
+
+  # Add owner of request and update job priority
+
+  def add_owner(self, owner, priority):
+    self.owners[owner] = priority
+    self.priority = min(self.owners.values())
+
+  # Check if request is no longer needed
+
+  def is_cancelled(self):
+    return self.cancellable and self.cancellable.is_cancelled()
+
+
+# Scheduler for outbound requests with priorities, per-host concurrency
+# caps, token bucket rate limit and backoff on 429/503 responses (requests
+# wait in queue while network is not available)
+
+class RequestScheduler:
+
+  # Set limits and initialize queue
+
+  def __init__(self, max_per_host, rate, burst):
+    self.max_per_host = max_per_host
+    self.rate = rate
+    self.burst = burst
+
+    self._tokens = burst
+    self._tokens_time = time.monotonic()
+    self._queue = []
+    self._active = {}
+    self._blocked = {}
+    self._failures = {}
+    self._serial = 0
+    self._timeout = 0
+    self._timeout_time = 0
+    self.online = True
+
+  # Add request to queue and start it when allowed
+
+  def submit(self, job):
+    self._serial += 1
+    job.serial = self._serial
+    self._queue.append(job)
+    self._dispatch()
+
+  # Set priority for queued requests of owner
+
+  def reprioritize(self, owner, priority):
+    for job in self._queue:
+      if owner in job.owners:
+        job.add_owner(owner, priority)
+
+  # Follow network availability from network monitor
+
+  def watch_network(self, monitor):
+    self.online = monitor.get_network_available()
+    monitor.connect('network-changed', self._network_changed_cb)
+
+  # Free host slot and block host for a while if server asks to slow down
+
+  def finished(self, job, status, retry_after):
+    host = job.host
+    self._active[host] -= 1
+
+    if status == 429 or status == 503:
+      failures = self._failures.get(host, 0) + 1
+      self._failures[host] = failures
+      if retry_after:
+        delay = retry_after
+      else:
+        delay = min(2 ** failures, 60)
+      self._blocked[host] = time.monotonic() + delay
+    else:
+      self._failures.pop(host, None)
+
+    self._dispatch()
+
+  # Start queued requests by priority while slots and tokens are available
+  # (background and prefetch requests can't take the last slot for a host)
+
+  def _dispatch(self):
+    now = time.monotonic()
+    self._refill(now)
+    wait = None
+
+    for job in sorted(self._queue, key=lambda job: (job.priority, job.serial)):
+      if job.is_cancelled():
+        self._queue.remove(job)
+        continue
+
+      if not self.online:
+        continue
+
+      blocked_until = self._blocked.get(job.host, 0)
+      if blocked_until > now:
+        wait = self._min_wait(wait, blocked_until - now)
+        continue
+
+      max_active = self.max_per_host
+      if job.priority > PRIORITY_FOREGROUND:
+        max_active = max(max_active - 1, 1)
+      if self._active.get(job.host, 0) >= max_active:
+        continue
+
+      if self._tokens < 1:
+        wait = self._min_wait(wait, (1 - self._tokens) / self.rate)
+        break
+
+      self._tokens -= 1
+      self._queue.remove(job)
+      self._active[job.host] = self._active.get(job.host, 0) + 1
+      job.start(job)
+
+    if wait is not None:
+      self._set_timeout(now + wait)
+
+  # Arm timeout to dispatch again at given time (moving armed one if earlier)
+
+  def _set_timeout(self, timeout_time):
+    if self._timeout:
+      if self._timeout_time <= timeout_time:
+        return
+      GLib.source_remove(self._timeout)
+
+    self._timeout_time = timeout_time
+    self._timeout = GLib.timeout_add(int((timeout_time - time.monotonic()) * 1000) + 1, self._timeout_cb)
+
+  # Refill token bucket for elapsed time
+
+  def _refill(self, now):
+    self._tokens = min(self.burst, self._tokens + (now - self._tokens_time) * self.rate)
+    self._tokens_time = now
+
+  # Get shortest wait time
+
+  def _min_wait(self, wait, new_wait):
+    if wait is None:
+      return new_wait
+    else:
+      return min(wait, new_wait)
+
+  # On network changed start queued requests if available
+
+  def _network_changed_cb(self, monitor, available):
+    self.online = available
+    if available:
+      self._dispatch()
+
+  # On wait timeout try to start requests again
+
+  def _timeout_cb(self):
+    self._timeout = 0
+    self._dispatch()
+    return GLib.SOURCE_REMOVE
@@ -3,9 +3,9 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 
-from gi.repository import Gio, Gtk, Adw
+from gi.repository import GLib, Gio, Gtk, Adw
 
-from wike import wikipedia
+from wike import tasks, thumbnails, wikipedia
 from wike.data import settings, languages
 from wike.languages import LanguagesDialog
 
@@ -29,6 +29,16 @@ class SearchPanel(Adw.Bin):
     self.window = window
     self._delegate = self.search_entry.get_delegate()
 
+    self._search_timeout = 0
+    self._search_future = None
+    self._search_futures = []
+    self._search_langs = []
+    self._search_hits = {}
+    self._key_time = 0
+    self._key_interval = 150
+    self._activate_timeout = 15
+    self._language_timeout = 5
+
     self.settings_popover = SettingsPopover(self)
     self.settings_button.set_popover(self.settings_popover)
 
@@ -40,19 +50,26 @@ class SearchPanel(Adw.Bin):
 
     self.search_entry.set_key_capture_widget(window)
 
-  # Populate search suggestions list
+  # Populate search suggestions list (dimmed if results are stale and with
+  # languages if results are from several ones)
+
+  def _populate(self, suggestions, stale=False, show_lang=False):
+    if stale:
+      self.suggestions_list.add_css_class('dim-label')
+    else:
+      self.suggestions_list.remove_css_class('dim-label')
 
-  def _populate(self, suggestions):
     while True:
       row = self.suggestions_list.get_row_at_index(0)
       if row:
+        row.cancel_thumbnail()
         self.suggestions_list.remove(row)
       else:
         break
 
     if suggestions:
-      for title, uri in zip(suggestions[0], suggestions[1]):
-        row = SearchRow(title, uri)
+      for hit in suggestions:
+        row = SearchRow(hit, show_lang)
         self.suggestions_list.append(row)
 
   # When entry loses focus select text
@@ -68,24 +85,127 @@ class SearchPanel(Adw.Bin):
     if not self._delegate.has_focus():
       self.search_entry.grab_focus()
 
+    self._cancel_search()
+
     if settings.get_boolean('search-suggestions'):
       text, lang = self._get_search_terms(search_entry.get_text())
       if len(text) > 2:
-        wikipedia.search(text.lower(), lang, 20, self._on_search_finished)
+        self._search_timeout = GLib.timeout_add(self._get_search_delay(), self._search_timeout_cb, text, lang)
       else:
         self._populate(None)
     else:
       self._populate(None)
 
-  # On search finished get results and populate suggestions list
+  # Get debounce delay (ms) adapted to typing speed
+
+  def _get_search_delay(self):
+    now = GLib.get_monotonic_time() // 1000
+    interval = now - self._key_time
+    self._key_time = now
+
+    if interval < 1000:
+      self._key_interval = (self._key_interval * 3 + interval) // 4
+
+    return min(max(self._key_interval * 3 // 2, 80), 350)
+
+  # When typing pauses run search async (in all user languages if enabled
+  # and no language prefix is used)
+
+  def _search_timeout_cb(self, text, lang):
+    self._search_timeout = 0
+    if settings.get_boolean('search-all-languages') and not self.search_entry.get_text().startswith('-'):
+      self._search_languages(text.lower(), lang)
+    else:
+      self._search_future = wikipedia.search(text.lower(), lang, 20, stale=True, rich=True)
+      self._search_future.add_done_callback(self._on_search_finished)
+
+    return GLib.SOURCE_REMOVE
+
+  # Search in all user languages at once (search language first) with a time
+  # limit for each one
+
+  def _search_languages(self, text, lang):
+    self._search_langs = [lang] + [lang_id for lang_id in languages.items if lang_id != lang]
+    self._search_hits = {}
+    self._search_futures = wikipedia.search_languages(text, self._search_langs, 10, timeout=self._language_timeout)
+    for future in self._search_futures:
+      future.add_done_callback(self._on_language_finished)
+
+  # Cancel pending and in-flight searches
+
+  def _cancel_search(self):
+    if self._search_timeout:
+      GLib.source_remove(self._search_timeout)
+      self._search_timeout = 0
+
+    if self._search_future:
+      future = self._search_future
+      self._search_future = None
+      future.cancel()
+
+    futures = self._search_futures
+    self._search_futures = []
+    for future in futures:
+      future.cancel()
 
-  def _on_search_finished(self, session, async_result, user_data):
+  # On search finished get results and populate suggestions list (drop
+  # results of previous searches and wait for fresh ones if stale, keeping
+  # stale ones if revalidation fails)
+
+  def _on_search_finished(self, future):
+    if future is not self._search_future:
+      return
+
+    self._search_future = None
     try:
-      results = wikipedia.search_result(async_result)
+      results = future.result()
     except:
-      self._populate(None)
+      if not self.suggestions_list.has_css_class('dim-label'):
+        self._populate(None)
     else:
-      self._populate(results)
+      self._populate(results, future.stale)
+      if future.stale:
+        self._search_future = future.revalidated
+        self._search_future.add_done_callback(self._on_search_finished)
+
+  # On search in one language finished merge results and populate
+  # suggestions list (drop results of previous searches)
+
+  def _on_language_finished(self, future):
+    if not future in self._search_futures:
+      return
+
+    lang = self._search_langs[self._search_futures.index(future)]
+    try:
+      self._search_hits[lang] = future.result()
+    except:
+      self._search_hits[lang] = None
+
+    merged = self._merge_hits()
+    if len(self._search_hits) == len(self._search_futures):
+      self._search_futures = []
+      self._populate(merged, show_lang=True)
+    elif merged:
+      self._populate(merged, show_lang=True)
+
+  # Merge results of languages ranked by position and language order (same
+  # article in several languages is shown in the first one)
+
+  def _merge_hits(self):
+    ranked = {}
+    for lang_index, lang in enumerate(self._search_langs):
+      hits = self._search_hits.get(lang)
+      if not hits:
+        continue
+      for position, hit in enumerate(hits):
+        key = hit.item or hit.uri
+        if key in ranked:
+          ranked[key][0] = min(ranked[key][0], position)
+        else:
+          ranked[key] = [position, lang_index, hit]
+
+    merged = sorted(ranked.values(), key=lambda item: (item[0], item[1]))
+    return [item[2] for item in merged[:20]]
 
   # Split search terms to get language prefix
 
@@ -121,18 +241,18 @@ class SearchPanel(Adw.Bin):
 
     text, lang = self._get_search_terms(search_entry.get_text())
     if text != '':
-      wikipedia.search(text.lower(), lang, 1, self._on_activate_result)
+      tasks.run(self._load_search_result(text.lower(), lang))
 
-  # On search activate finished get result and load article
+  # Search for text and load first article found
   
-  def _on_activate_result(self, session, async_result, user_data):
+  async def _load_search_result(self, text, lang):
     try:
-      results = wikipedia.search_result(async_result)
-    except:
+      results = await wikipedia.search(text, lang, 1, timeout=self._activate_timeout, stale=True)
+    except Exception:
       self.window.page.wikiview.load_message('error')
     else:
       if results:
-        uri = results[1][0]
+        uri = results[0].uri
         self.window.page.wikiview.load_wiki(uri)
       else:
         self.window.page.wikiview.load_message('notfound')
@@ -153,17 +273,46 @@ class SearchRow(Gtk.ListBoxRow):
 
   __gtype_name__ = 'SearchRow'
 
+  thumbnail_image = Gtk.Template.Child()
   suggestion_label = Gtk.Template.Child()
+  description_label = Gtk.Template.Child()
+  lang_label = Gtk.Template.Child()
 
-  # Set label title and uri
+  # Set title and uri from search hit and show description and thumbnail if
+  # available (and language if requested)
 
-  def __init__(self, title, uri):
+  def __init__(self, hit, show_lang=False):
     super().__init__()
     
-    self.title = title
-    self.uri = uri
+    self.title = hit.title
+    self.uri = hit.uri
+    self._thumbnail_cancellable = Gio.Cancellable()
+
+    self.suggestion_label.set_label(hit.title)
+    if show_lang and hit.lang:
+      self.lang_label.set_label(hit.lang)
+      self.lang_label.set_visible(True)
+    if hit.description:
+      self.description_label.set_label(hit.description)
+      self.description_label.set_visible(True)
+    if hit.thumbnail:
+      thumbnails.load(hit.thumbnail, self._thumbnail_cancellable).add_done_callback(self._on_thumbnail_loaded)
+
+  # Cancel thumbnail loading (row is removed)
+
+  def cancel_thumbnail(self):
+    self._thumbnail_cancellable.cancel()
+
+  # On thumbnail loaded show it
+
+  def _on_thumbnail_loaded(self, future):
+    try:
+      texture = future.result()
+    except:
+      return
 
-    self.suggestion_label.set_label(title)
+    self.thumbnail_image.set_from_paintable(texture)
+    self.thumbnail_image.set_visible(True)
 
 
 # Popover for search settings
@@ -176,6 +325,7 @@ class SettingsPopover(Gtk.Popover):
   languages_button = Gtk.Template.Child()
   languages_list = Gtk.Template.Child()
   suggestions_switch = Gtk.Template.Child()
+  all_languages_switch = Gtk.Template.Child()
 
   # Populate search languages list and connect signals and bindings
 
@@ -189,6 +339,8 @@ class SettingsPopover(Gtk.Popover):
 
     settings.bind('search-suggestions', self.suggestions_switch, 'active', Gio.SettingsBindFlags.DEFAULT)
     settings.connect('changed::search-suggestions', self._settings_search_suggestions_changed_cb)
+    settings.bind('search-all-languages', self.all_languages_switch, 'active', Gio.SettingsBindFlags.DEFAULT)
+    settings.connect('changed::search-all-languages', self._settings_search_suggestions_changed_cb)
     settings.connect('changed::show-flags', self._settings_show_flags_changed_cb)
     
     self.languages_button.connect('clicked', self._languages_button_clicked_cb)
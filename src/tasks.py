@@ -0,0 +1,278 @@
+# This file is part of Wike (com.github.hugolabe.Wike)
+# SPDX-FileCopyrightText: 2021-25 Hugo Olabera
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+
+import traceback
+
+from gi.repository import GObject, GLib, Gio
+
+
+# Error set in futures cancelled before having a result
+
+class CancelledError(Exception):
+  pass
+
+
+# Result of an async operation completed from the GLib main loop
+# (can be awaited from coroutines run with run function). Stale results
+# are followed by a revalidated future with the fresh one
+
+class Future:
+
+  # Set own cancellable, cancelled with owner cancellable of caller (so a
+  # timeout cancels only this operation), and connect cancelled signals (as
+  # GObject signals, since Gio.Cancellable connect and disconnect are not
+  # signal methods)
+
+  def __init__(self, cancellable=None):
+    self.cancellable = Gio.Cancellable()
+    self.owner = cancellable
+
+    self.stale = False
+    self.revalidated = None
+
+    self._done = False
+    self._result = None
+    self._error = None
+    self._retrieved = False
+    self._callbacks = []
+    self._timeout = 0
+    self._handler = GObject.Object.connect(self.cancellable, 'cancelled', self._cancelled_cb)
+    self._owner_handler = 0
+    if self.owner:
+      self._owner_handler = GObject.Object.connect(self.owner, 'cancelled', self._owner_cancelled_cb)
+      if self.owner.is_cancelled():
+        self.cancellable.cancel()
+
+  # Check if future has a result or an error
+
+  def done(self):
+    return self._done
+
+  # Check if future was cancelled
+
+  def cancelled(self):
+    return isinstance(self._error, CancelledError)
+
+  # Get result or raise error
+
+  def result(self):
+    if not self._done:
+      raise RuntimeError('Future is not done')
+    self._retrieved = True
+    if self._error:
+      raise self._error
+
+    return self._result
+
+  # Set result and run callbacks (ignored if already done)
+
+  def set_result(self, result):
+    if self._done:
+      return
+
+    self._result = result
+    self._finish()
+
+  # Set error and run callbacks (ignored if already done)
+
+  def set_error(self, error):
+    if self._done:
+      return
+
+    self._error = error
+    self._finish()
+
+  # Add callback run with future when done (at once if already done)
+
+  def add_done_callback(self, callback):
+    if self._done:
+      callback(self)
+    else:
+      self._callbacks.append(callback)
+
+  # Cancel operation and set cancelled error
+
+  def cancel(self):
+    if not self._done:
+      self.cancellable.cancel()
+
+  # Fail with timeout error if not done after some seconds
+
+  def set_timeout(self, seconds):
+    if not self._done:
+      self._timeout = GLib.timeout_add(int(seconds * 1000), self._timeout_cb)
+
+  # Return self to coroutine until done and then its result
+
+  def __await__(self):
+    if not self._done:
+      yield self
+
+    return self.result()
+
+  # Release cancellable and timeout and run callbacks
+
+  def _finish(self):
+    self._done = True
+    GObject.signal_handler_disconnect(self.cancellable, self._handler)
+    if self._owner_handler:
+      GObject.signal_handler_disconnect(self.owner, self._owner_handler)
+      self._owner_handler = 0
+    if self._timeout:
+      GLib.source_remove(self._timeout)
+      self._timeout = 0
+
+    callbacks = self._callbacks
+    self._callbacks = []
+    for callback in callbacks:
+      callback(self)
+
+  # On cancellable cancelled set cancelled error
+
+  def _cancelled_cb(self, cancellable):
+    self.set_error(CancelledError())
+
+  # On owner cancellable cancelled cancel operation
+
+  def _owner_cancelled_cb(self, owner):
+    self.cancellable.cancel()
+
+  # On timeout set error and cancel operation (not other operations of owner)
+
+  def _timeout_cb(self):
+    self._timeout = 0
+    self.set_error(TimeoutError())
+    self.cancellable.cancel()
+    return GLib.SOURCE_REMOVE
+
+
+# Coroutine driven by the futures it awaits (its future has coroutine result)
+
+class Task(Future):
+
+  # Start running coroutine
+
+  def __init__(self, coroutine):
+    super().__init__()
+
+    self._coroutine = coroutine
+    self._waiting = None
+    self._step(None, None)
+
+  # Cancel awaited future and close coroutine without resuming it
+
+  def cancel(self):
+    if self._done:
+      return
+
+    waiting = self._waiting
+    self._waiting = None
+    if waiting:
+      waiting.cancel()
+    self._coroutine.close()
+    super().cancel()
+
+  # Resume coroutine with value or error until it awaits a future
+
+  def _step(self, value, error):
+    try:
+      if error:
+        future = self._coroutine.throw(error)
+      else:
+        future = self._coroutine.send(value)
+    except StopIteration as stop:
+      self.set_result(stop.value)
+      return
+    except Exception as error:
+      self.set_error(error)
+      if not isinstance(error, (CancelledError, TimeoutError)):
+        GLib.idle_add(self._report_error_cb)
+      return
+
+    self._waiting = future
+    future.add_done_callback(self._wakeup)
+
+  # Print traceback of error if nobody got it from task (when run without
+  # done callbacks, errors in coroutine would be lost)
+
+  def _report_error_cb(self):
+    if not self._retrieved:
+      print('Task failed:')
+      traceback.print_exception(type(self._error), self._error, self._error.__traceback__)
+
+    return GLib.SOURCE_REMOVE
+
+  # On awaited future done resume coroutine
+
+  def _wakeup(self, future):
+    if future is not self._waiting:
+      return
+
+    self._waiting = None
+    try:
+      value = future.result()
+    except Exception as error:
+      self._step(None, error)
+    else:
+      self._step(value, None)
+
+
+# Run coroutine in main loop and get its task
+
+def run(coroutine):
+  return Task(coroutine)
+
+# Get future with result of future if done within some seconds (fails with
+# timeout error otherwise, leaving future running)
+
+def within(future, seconds):
+  limited = Future()
+  limited.set_timeout(seconds)
+  future.add_done_callback(lambda future: _copy_result(future, limited))
+  return limited
+
+# Get future with list of results when all futures are done (fails with
+# first error unless errors are returned as results)
+
+def gather(futures, return_errors=False):
+  gathered = Future()
+  pending = [len(futures)]
+
+  if not futures:
+    gathered.set_result([])
+    return gathered
+
+  def _future_done(future):
+    result = _get_result(future)
+    if isinstance(result, Exception) and not return_errors:
+      for other in futures:
+        other.cancel()
+      gathered.set_error(result)
+      return
+
+    pending[0] -= 1
+    if pending[0] == 0:
+      gathered.set_result([_get_result(future) for future in futures])
+
+  for future in futures:
+    future.add_done_callback(_future_done)
+
+  return gathered
+
+# Set result or error of future in other future
+
+def _copy_result(future, other):
+  try:
+    other.set_result(future.result())
+  except Exception as error:
+    other.set_error(error)
+
+# Get result of future or its error
+
+def _get_result(future):
+  try:
+    return future.result()
+  except Exception as error:
+    return error
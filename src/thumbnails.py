@@ -0,0 +1,137 @@
+# This file is part of Wike (com.github.hugolabe.Wike)
+# SPDX-FileCopyrightText: 2021-25 Hugo Olabera
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+
+import functools, urllib.parse
+from collections import OrderedDict
+
+from gi.repository import GLib, Gio, Gdk, Soup
+
+from wike import wikipedia
+from wike.cache import FileCache
+from wike.scheduler import RequestJob, PRIORITY_BACKGROUND
+from wike.tasks import Future
+
+
+# Create disk cache for thumbnail images in user data dir
+
+file_cache = FileCache(GLib.get_user_data_dir() + '/cache/thumbnails', 500)
+
+# Thumbnail textures in memory by url (least recently used removed over
+# limit) and download job and futures waiting for thumbnails being
+# downloaded
+
+_textures = OrderedDict()
+_max_textures = 100
+_loading = {}
+
+# Get thumbnail texture for url (future) from memory, disk or network
+
+def load(url, cancellable=None):
+  future = Future(cancellable)
+  if future.done():
+    return future
+
+  texture = _get_texture(url)
+  if texture:
+    future.set_result(texture)
+    return future
+
+  if not url in _loading:
+    host = urllib.parse.urlparse(url).netloc
+    job = RequestJob(host, _start_request, url, Gio.Cancellable())
+    job.add_owner(None, PRIORITY_BACKGROUND)
+    _loading[url] = (job, [])
+    wikipedia.get_session()
+    wikipedia.scheduler.submit(job)
+
+  _loading[url][1].append(future)
+  future.add_done_callback(functools.partial(_on_future_done, url))
+  return future
+
+# Remove thumbnails from memory and disk
+
+def clear():
+  _textures.clear()
+  file_cache.clear()
+
+# Get texture for url from memory or disk cache
+
+def _get_texture(url):
+  if url in _textures:
+    _textures.move_to_end(url)
+    return _textures[url]
+
+  data = file_cache.get(url)
+  if data:
+    try:
+      texture = Gdk.Texture.new_from_bytes(GLib.Bytes.new(data))
+    except:
+      return None
+    _add_texture(url, texture)
+    return texture
+
+  return None
+
+# Add texture to memory cache
+
+def _add_texture(url, texture):
+  _textures[url] = texture
+  while len(_textures) > _max_textures:
+    _textures.popitem(last=False)
+
+# On future cancelled stop waiting for thumbnail, and cancel download if
+# nobody else waits for it
+
+def _on_future_done(url, future):
+  if not future.cancelled() or not url in _loading:
+    return
+
+  job, futures = _loading[url]
+  if future in futures:
+    futures.remove(future)
+  if len(futures) == 0:
+    del _loading[url]
+    job.cancellable.cancel()
+
+# Send thumbnail request when started by scheduler
+
+def _start_request(job):
+  message = Soup.Message.new('GET', job.request_data)
+  wikipedia.get_session().send_and_read_async(message, GLib.PRIORITY_LOW, job.cancellable, _on_request_finished, (message, job))
+
+# On thumbnail request finished store image and set texture for futures
+
+def _on_request_finished(session, async_result, request_data):
+  message, job = request_data
+  url = job.request_data
+
+  try:
+    response = session.send_and_read_finish(async_result)
+  except:
+    response = None
+
+  status = message.get_status()
+  wikipedia.scheduler.finished(job, status, 0)
+
+  texture = None
+  if response and status == Soup.Status.OK:
+    try:
+      texture = Gdk.Texture.new_from_bytes(response)
+    except:
+      texture = None
+    else:
+      file_cache.put(url, response.get_data())
+      _add_texture(url, texture)
+
+  if url in _loading and _loading[url][0] is job:
+    futures = _loading.pop(url)[1]
+  else:
+    futures = []
+
+  for future in futures:
+    if texture:
+      future.set_result(texture)
+    else:
+      future.set_error(ValueError('Can’t load thumbnail'))
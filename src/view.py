@@ -7,7 +7,7 @@ import urllib.parse
 
 from gi.repository import GLib, GObject, Gio, Gdk, Gtk, Adw, WebKit
 
-from wike import wikipedia
+from wike import tasks, wikipedia
 from wike.data import settings, languages, bookmarks
 
 
@@ -20,6 +20,16 @@ cookie_manager.set_accept_policy(WebKit.CookieAcceptPolicy.ALWAYS)
 cookie_manager.set_persistent_storage(cookies_file_path, WebKit.CookiePersistentStorage.TEXT)
 
 
+# Warm up connections to Wikipedia hosts for languages (API session and DNS
+# for article views)
+
+def preconnect(langs):
+  for lang in langs:
+    wikipedia.preconnect(lang)
+    network_session.prefetch_dns(lang + '.wikipedia.org')
+    network_session.prefetch_dns(lang + '.m.wikipedia.org')
+
+
 # Settings and user content with custom css for wikiviews
 
 class ViewSettings(GObject.GObject):
@@ -135,6 +145,7 @@ view_settings = ViewSettings()
 class WikiView(WebKit.WebView):
 
   __gsignals__ = { 'load-props': (GObject.SIGNAL_RUN_FIRST, None, ()),
+                   'load-langlinks': (GObject.SIGNAL_RUN_FIRST, None, ()),
                    'new-page': (GObject.SIGNAL_RUN_FIRST, None, (str,)),
                    'add-bookmark': (GObject.SIGNAL_RUN_FIRST, None, (str, str, str,)) }
 
@@ -149,6 +160,13 @@ class WikiView(WebKit.WebView):
   def __init__(self):
     super().__init__(settings=view_settings.web_settings, user_content_manager=view_settings.user_content)
 
+    self._load_uri = None
+    self._props_cancellable = None
+    self._props_task = None
+    self._langlinks_cancellable = None
+    self._langlinks_task = None
+    self._priority = wikipedia.PRIORITY_BACKGROUND
+
     self.set_background_color(Gdk.RGBA(1, 1, 1, 0))
     self.set_zoom_level(settings.get_int('zoom-level') / 100)
 
@@ -181,11 +199,11 @@ class WikiView(WebKit.WebView):
   def _set_skin_cb(self, view_settings, is_dark):
     self.set_wikipedia_skin(is_dark)
 
-  # Load Wikipedia article by URI
+  # Load Wikipedia article by URI (skipping known redirects)
 
   def load_wiki(self, uri):
     self.stop_loading()
-    self.load_uri(uri)
+    self.load_uri(wikipedia.resolve_uri(uri))
 
   # Go to section in page
 
@@ -204,17 +222,25 @@ class WikiView(WebKit.WebView):
     uri = 'https://' + settings.get_string('search-language') + '.wikipedia.org'
     self.load_wiki(uri)
 
-  # Get Wikipedia random article async
+  # Load random article from prefetched pool or get it async (error page at
+  # once if offline, since request would wait for network)
 
   def load_random(self):
-    wikipedia.get_random(settings.get_string('search-language'), self._on_random_finished)
+    lang = settings.get_string('search-language')
+    uri = wikipedia.pop_random(lang)
+    if uri:
+      self.load_wiki(uri)
+    elif not wikipedia.is_online():
+      self.load_message('error')
+    else:
+      tasks.run(self._load_random(lang))
 
-  # On random finished get results
+  # Get random article and load it
 
-  def _on_random_finished(self, session, async_result, user_data):
+  async def _load_random(self, lang):
     try:
-      uri = wikipedia.random_result(async_result)
-    except:
+      uri = await wikipedia.get_random(lang)
+    except Exception:
       self.load_message('error')
     else:
       if uri:
@@ -240,6 +266,11 @@ class WikiView(WebKit.WebView):
     else:
       return uri
 
+  # Get canonical uri for current article (following known redirects)
+
+  def get_canonical_uri(self):
+    return wikipedia.resolve_uri(self.get_base_uri())
+
   # Get language for current article
 
   def get_lang(self):
@@ -254,6 +285,18 @@ class WikiView(WebKit.WebView):
       lang = uri_netloc.split('.', 1)[0]
       return lang
 
+  # Check if current page is Wikipedia main page (or known redirect target)
+
+  def is_main_page(self):
+    if self.is_local():
+      return False
+
+    if self.get_uri().endswith('.wikipedia.org/'):
+      return True
+
+    main_uri = wikipedia.resolve_uri('https://' + urllib.parse.urlparse(self.get_uri())[1] + '/')
+    return self.get_base_uri() == main_uri
+
   # Check if current page is local (status page)
 
   def is_local(self):
@@ -288,9 +331,14 @@ class WikiView(WebKit.WebView):
     else:
       return ''
 
-  # Set toc, langlinks and title for current article
+  # Set toc, langlinks and title for current article (only redirect from
+  # wiki root to main page is taken from load, article redirects come from
+  # properties so special pages like random ones are never remembered)
 
   def do_load_changed(self, event):
+    if event == WebKit.LoadEvent.STARTED:
+      self._load_uri = self.get_uri()
+      self.cancel_properties()
     if event != WebKit.LoadEvent.COMMITTED:
       return
 
@@ -313,27 +361,140 @@ class WikiView(WebKit.WebView):
       self.emit('load-props')
       return
     else:
+      if self._load_uri and self.is_wiki_uri(self._load_uri) == 'https://' + uri_netloc + '/':
+        wikipedia.add_redirect('https://' + uri_netloc + '/', self.get_base_uri())
+
       page = uri_path.replace('/wiki/', '', 1)
       lang = uri_netloc.split('.', 1)[0]
-      wikipedia.get_properties(page, lang, self._on_properties_finished, page)
+      self.cancel_properties()
+
+      props = wikipedia.get_stored_properties(page, lang)
+      prefetched = wikipedia.get_prefetched_properties(page, lang)
+      if props and prefetched and props['revid'] == prefetched['revid']:
+        self._set_properties(props)
+        self.emit('load-props')
+        return
+
+      self._props_cancellable = Gio.Cancellable()
+      self._props_task = tasks.run(self._load_properties(page, lang, props, prefetched, self._props_cancellable))
+
+  # Cancel in-flight properties and langlinks requests (tasks are cancelled
+  # first so they are not resumed)
+
+  def cancel_properties(self):
+    if self._props_task:
+      self._props_task.cancel()
+      self._props_task = None
+    if self._props_cancellable:
+      self._props_cancellable.cancel()
+      self._props_cancellable = None
+
+    if self._langlinks_task:
+      self._langlinks_task.cancel()
+      self._langlinks_task = None
+    if self._langlinks_cancellable:
+      self._langlinks_cancellable.cancel()
+      self._langlinks_cancellable = None
+
+  # Get langlinks for current article if not loaded yet
+
+  def load_langlinks(self):
+    if self.langlinks is not None or (self._langlinks_task and not self._langlinks_task.done()):
+      return
 
-  # On properties finished get results
+    uri = self.get_uri()
+    if not uri:
+      return
 
-  def _on_properties_finished(self, session, async_result, page):
-    try:
-      props = wikipedia.properties_result(async_result)
-    except:
-      self.emit('load-props')
+    uri_elements = urllib.parse.urlparse(uri)
+    uri_netloc = uri_elements[1]
+    uri_path = uri_elements[2]
+    if not (uri_netloc.endswith('.wikipedia.org') and uri_path.startswith('/wiki/')):
+      return
+
+    page = uri_path.replace('/wiki/', '', 1)
+    lang = uri_netloc.split('.', 1)[0]
+    self._langlinks_cancellable = Gio.Cancellable()
+    self._langlinks_task = tasks.run(self._load_langlinks(page, lang, self._langlinks_cancellable))
+
+  # Set priority of requests for view in selected or background tab
+
+  def set_foreground(self, foreground):
+    if foreground:
+      self._priority = wikipedia.PRIORITY_FOREGROUND
     else:
+      self._priority = wikipedia.PRIORITY_BACKGROUND
+
+    if self._props_cancellable:
+      wikipedia.set_priority(self._props_cancellable, self._priority)
+    if self._langlinks_cancellable:
+      wikipedia.set_priority(self._langlinks_cancellable, self._priority)
+
+  # Set title, sections and langlinks (if included) from page properties
+
+  def _set_properties(self, props):
+    self.title = props['title']
+    self.sections = props['sections']
+    if props.get('langlinks') is not None:
+      self.langlinks = props['langlinks']
+
+    base_uri = self.get_base_uri()
+    host = urllib.parse.urlparse(base_uri)[1]
+    wikipedia.add_redirect(base_uri, wikipedia.get_title_uri(host, self.title))
+
+  # Load properties for article (checking first if stored ones are outdated)
+  # and emit signal when loaded (again when revalidated if they were stale).
+  # If offline and nothing is stored title is set from page while request
+  # waits for network
+
+  async def _load_properties(self, page, lang, props, prefetched, cancellable):
+    if not (props or prefetched or wikipedia.is_online()):
+      title_raw = page.replace('_', ' ')
+      self.title = urllib.parse.unquote(title_raw)
+      self.emit('load-props')
+
+    if props:
+      self._set_properties(props)
+      self.emit('load-props')
+      try:
+        last_revid = await wikipedia.get_revision(page, lang, cancellable, self._priority)
+      except Exception:
+        last_revid = props['revid']
+      if last_revid == props['revid']:
+        return
+    elif prefetched:
+      self._set_properties(prefetched)
+      self.emit('load-props')
+
+    future = wikipedia.get_properties(page, lang, cancellable, self._priority, stale=True)
+    while future:
+      try:
+        props = await future
+      except Exception:
+        self.emit('load-props')
+        return
+
       if props:
-        self.title = props['title']
-        self.sections = props['sections']
-        self.langlinks = props['langlinks']
+        self._set_properties(props)
+        wikipedia.store_properties(page, lang, props, self.langlinks)
       else:
         title_raw = page.replace('_', ' ')
         self.title = urllib.parse.unquote(title_raw)
       self.emit('load-props')
 
+      future = future.revalidated
+
+  # Load langlinks for article and emit signal when loaded
+
+  async def _load_langlinks(self, page, lang, cancellable):
+    try:
+      self.langlinks = await wikipedia.get_langlinks(page, lang, cancellable, self._priority)
+    except Exception:
+      return
+
+    wikipedia.store_langlinks(page, lang, self.langlinks)
+    self.emit('load-langlinks')
+
   # Webview load error event
 
   def do_load_failed(self, event, uri, error):
@@ -456,7 +617,7 @@ class WikiView(WebKit.WebView):
   # On context menu activated add bookmark
 
   def _add_bookmark_cb(self, action, parameter):
-    uri = parameter.get_string()
+    uri = wikipedia.resolve_uri(parameter.get_string())
     uri_elements = urllib.parse.urlparse(uri)
     uri_netloc = uri_elements[1]
     uri_path = uri_elements[2]
@@ -3,19 +3,104 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 
-import json, urllib.parse
+import os, json, time, functools, urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 
-from gi.repository import Soup
+from gi.repository import GObject, GLib, Gio, Soup
 
+from wike.cache import ResponseCache, PropertiesCache, SuggestionCache, RandomPool, RedirectMap
+from wike.metrics import RequestRecord, RequestLog, LoopLagMonitor
+from wike.tasks import Future
+from wike.scheduler import RequestScheduler, RequestJob, PRIORITY_FOREGROUND, PRIORITY_BACKGROUND, PRIORITY_PREFETCH
 
-# Create a Soup session and set user agent
 
-session = Soup.Session.new()
-session.set_user_agent('Wike/3.2.1 (https://github.com/hugolabe)')
+# Soup session (created on first network request)
 
-# Get Wikipedia random page
+session = None
 
-def get_random(lang, callback):
+# Create scheduler for async requests (4 per host, 10 per second, bursts of 20)
+
+scheduler = RequestScheduler(4, 10, 20)
+
+# Create response cache (expired responses served as stale for a day) and
+# set time to live (seconds) for each API action
+
+response_cache = ResponseCache(200, 8 * 1024 * 1024, 86400)
+
+_cache_ttls = { 'opensearch': 600,
+                'parse': 1800,
+                'query': 300 }
+
+# Create disk cache for article properties in user data dir
+
+properties_cache = PropertiesCache(GLib.get_user_data_dir() + '/cache/properties', 1000)
+
+# Create disk cache for rich search results shared with search provider
+# (fresh for a day and served as stale for 30 days)
+
+_suggestion_ttl = 86400
+
+suggestion_cache = SuggestionCache(GLib.get_user_data_dir() + '/cache/suggestions.db', 5000, 30 * 86400, _suggestion_ttl)
+
+# Create pool of random articles, refilled when it has few left
+
+random_pool = RandomPool(GLib.get_user_data_dir() + '/random.json', 40)
+
+_random_size = 20
+_random_low = 5
+_random_filling = set()
+
+# Create map of known redirects to canonical article uris (kept 30 days)
+
+redirect_map = RedirectMap(GLib.get_user_data_dir() + '/redirects.json', 5000, 30 * 86400)
+
+# Properties prefetched in batches by (lang, title) and max titles per batch
+
+_prefetched = {}
+_batch_size = 50
+
+# Version of properties format in disk cache
+
+_stored_version = 2
+
+# Size of thumbnails in rich search results (pixels)
+
+_thumbnail_size = 80
+
+# Hosts preconnected by time and seconds to consider connection still warm
+
+_preconnected = {}
+_preconnect_ttl = 60
+
+# Identical requests in flight (by cache key) and request counters
+
+_in_flight = {}
+_counters = { 'sent': 0,
+              'coalesced': 0,
+              'decode_main_ms': 0.0,
+              'decode_worker_ms': 0.0,
+              'callback_ms': 0.0 }
+
+# Create log of last requests with timing, size, status and cache outcome
+# (WIKE_REQUEST_STATS=1 prints its summary when app quits and measures main
+# loop lag every 20 ms, keeping last 5 minutes)
+
+request_log = RequestLog(500)
+request_stats = os.environ.get('WIKE_REQUEST_STATS') == '1'
+
+loop_lag = LoopLagMonitor(20, 15000, 50)
+if request_stats:
+  loop_lag.start()
+
+# Create worker pool for decoding responses (WIKE_DECODE_INLINE=1 decodes in
+# main loop instead, to compare main loop lag in both modes)
+
+_decode_inline = os.environ.get('WIKE_DECODE_INLINE') == '1'
+_decode_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='wike-decode')
+
+# Get Wikipedia random page (future with article uri)
+
+def get_random(lang, cancellable=None, priority=PRIORITY_FOREGROUND, timeout=None):
   endpoint = 'https://' + lang + '.wikipedia.org/w/api.php'
   params = { 'action': 'query',
              'generator': 'random',
@@ -23,95 +108,889 @@ def get_random(lang, callback):
              'grnnamespace': 0,
              'prop': 'info',
              'inprop': 'url',
-             'format': 'json' }
+             'format': 'json',
+             'formatversion': 2 }
 
-  _request(endpoint, params, callback, None)
+  return _request_future(endpoint, params, cancellable, priority, timeout, _shape_random)
 
-# Get random result from response data
+# Get random article from pool (None if empty) and refill pool if needed
 
-def random_result(async_result):
-  response = session.send_and_read_finish(async_result)
-  data = response.get_data()
-  result = json.loads(data)
-
-  pages = result['query']['pages']
-  page_props = list(pages.values())[0]
-  uri = page_props['fullurl']
+def pop_random(lang):
+  uri = random_pool.pop(lang)
+  refill_random(lang)
   return uri
 
-# Search Wikipedia with a limit of responses
+# Request a batch of random articles if pool has few left
+
+def refill_random(lang):
+  if lang in _random_filling or random_pool.count(lang) > _random_low:
+    return
+
+  endpoint = 'https://' + lang + '.wikipedia.org/w/api.php'
+  params = { 'action': 'query',
+             'generator': 'random',
+             'grnlimit': _random_size,
+             'grnnamespace': 0,
+             'prop': 'info',
+             'inprop': 'url',
+             'format': 'json',
+             'formatversion': 2 }
+
+  _random_filling.add(lang)
+  _request(endpoint, params, _on_refill_random_finished, lang, None, PRIORITY_PREFETCH, _shape_random_list)
+
+# On random batch finished add articles to pool
+
+def _on_refill_random_finished(result, lang):
+  _random_filling.discard(lang)
+  try:
+    uris = _unwrap(result)
+  except:
+    return
+
+  random_pool.extend(lang, uris)
+
+# Search Wikipedia with a limit of responses (future with list of search
+# hits or None, stale results allowed if requested). Rich results include
+# language, description and thumbnail url from a single prefix search query
+# and are kept in suggestions cache
+
+def search(text, lang, limit, cancellable=None, priority=PRIORITY_FOREGROUND, timeout=None, stale=False, rich=False):
+  if rich:
+    return _search_rich(text, lang, limit, cancellable, priority, timeout, stale)
 
-def search(text, lang, limit, callback):
   endpoint = 'https://' + lang + '.wikipedia.org/w/api.php'
   params = { 'action': 'opensearch',
              'search': text,
              'limit': limit,
              'namespace': 0,
              'redirects': 'resolve',
-             'format': 'json' }
+             'format': 'json',
+             'formatversion': 2 }
 
-  if callback:
-    _request(endpoint, params, callback, None)
-    return
+  return _request_future(endpoint, params, cancellable, priority, timeout, _shape_search, stale)
 
-  data = _request(endpoint, params, None, None)
+# Search Wikipedia in several languages at once with prefix search (list of
+# futures with rich search hits including language)
 
-  if data:
-    result = json.loads(data)
-    if len(result[1]) > 0:
-      return result[1], result[3]
+def search_languages(text, langs, limit, cancellable=None, priority=PRIORITY_FOREGROUND, timeout=None):
+  return [_search_rich(text, lang, limit, cancellable, priority, timeout) for lang in langs]
 
-  return None
+# Get various properties for Wikipedia page (future with dict of title,
+# revision id and sections, stale results allowed if requested; langlinks
+# are requested apart)
 
-# Get search results from response data
+def get_properties(page, lang, cancellable=None, priority=PRIORITY_FOREGROUND, timeout=None, stale=False):
+  endpoint = 'https://' + lang + '.wikipedia.org/w/api.php'
+  params = { 'action': 'parse',
+             'prop': 'sections|revid',
+             'redirects': 1,
+             'page': page,
+             'format': 'json',
+             'formatversion': 2 }
 
-def search_result(async_result):
-  response = session.send_and_read_finish(async_result)
-  data = response.get_data()
-  result = json.loads(data)
+  return _request_future(endpoint, params, cancellable, priority, timeout, _shape_properties, stale)
 
-  if len(result[1]) > 0:
-    return result[1], result[3]
-  else:
-    return None
+# Get last revision id for Wikipedia page (future with revision id)
 
-# Get various properties for Wikipedia page
+def get_revision(page, lang, cancellable=None, priority=PRIORITY_FOREGROUND, timeout=None):
+  endpoint = 'https://' + lang + '.wikipedia.org/w/api.php'
+  params = { 'action': 'query',
+             'prop': 'info',
+             'redirects': 1,
+             'titles': page,
+             'format': 'json',
+             'formatversion': 2 }
 
-def get_properties(page, lang, callback, user_data):
+  return _request_future(endpoint, params, cancellable, priority, timeout, _shape_revision)
+
+# Get language links for Wikipedia page (future with list of langlinks)
+
+def get_langlinks(page, lang, cancellable=None, priority=PRIORITY_FOREGROUND, timeout=None):
   endpoint = 'https://' + lang + '.wikipedia.org/w/api.php'
   params = { 'action': 'parse',
-             'prop': 'sections|langlinks',
+             'prop': 'langlinks',
              'redirects': 1,
              'page': page,
-             'format': 'json' }
+             'format': 'json',
+             'formatversion': 2 }
 
-  _request(endpoint, params, callback, user_data)
+  return _request_future(endpoint, params, cancellable, priority, timeout, _shape_langlinks)
 
-# Get properties result from response data
+# Get description and thumbnail url for several pages with one batched
+# query (future with dict of rich search hits by requested title, missing
+# pages left out)
 
-def properties_result(async_result):
-  response = session.send_and_read_finish(async_result)
-  data = response.get_data()
-  result = json.loads(data)
+def get_summaries(titles, lang, cancellable=None, priority=PRIORITY_FOREGROUND, timeout=None):
+  endpoint = 'https://' + lang + '.wikipedia.org/w/api.php'
+  titles = titles[:_batch_size]
+  params = { 'action': 'query',
+             'prop': 'info|description|pageimages',
+             'inprop': 'url',
+             'piprop': 'thumbnail',
+             'pithumbsize': _thumbnail_size,
+             'pilimit': len(titles),
+             'redirects': 1,
+             'titles': '|'.join(titles),
+             'format': 'json',
+             'formatversion': 2 }
+  shape = functools.partial(_shape_summaries, titles=titles, lang=lang)
+
+  return _request_future(endpoint, params, cancellable, priority, timeout, shape)
+
+# Prefetch title, url and revision id for several pages (list of host and
+# page) with batched info queries, one for each 50 pages (sections are not
+# available from query API and langlinks are loaded when shown)
+
+def prefetch_properties(pages, lang, priority=PRIORITY_PREFETCH):
+  for i in range(0, len(pages), _batch_size):
+    batch = { 'pages': pages[i:i + _batch_size],
+              'lang': lang }
+    _request_batch(batch, priority)
+
+# Get prefetched properties for Wikipedia page (sections not included).
+# They are kept by canonical title, which is the page views load since
+# prefetching adds the redirect from the requested page
+
+def get_prefetched_properties(page, lang):
+  return _prefetched.pop((lang, _page_title(page)), None)
+
+# Get stored properties for Wikipedia page from disk cache
+
+def get_stored_properties(page, lang):
+  stored_props = properties_cache.get(lang, _page_title(page))
+  if not stored_props or stored_props.get('version') != _stored_version:
+    return None
+
+  props = { 'title': stored_props['title'],
+            'revid': stored_props['revid'],
+            'sections': [Section(*values) for values in stored_props['sections']],
+            'langlinks': None }
+  if stored_props['langlinks'] is not None:
+    props['langlinks'] = [LangLink(*values) for values in stored_props['langlinks']]
+
+  return props
+
+# Store properties and langlinks (None if not loaded) for Wikipedia page in
+# disk cache
+
+def store_properties(page, lang, props, langlinks):
+  stored_props = { 'version': _stored_version,
+                   'title': props['title'],
+                   'revid': props.get('revid'),
+                   'sections': [section.pack() for section in props['sections']],
+                   'langlinks': None }
+  if langlinks is not None:
+    stored_props['langlinks'] = [langlink.pack() for langlink in langlinks]
+
+  properties_cache.put(lang, _page_title(page), stored_props)
+
+# Add langlinks to stored properties for Wikipedia page
 
-  return result['parse']
+def store_langlinks(page, lang, langlinks):
+  stored_props = properties_cache.get(lang, _page_title(page))
+  if stored_props and stored_props.get('version') == _stored_version:
+    stored_props['langlinks'] = [langlink.pack() for langlink in langlinks]
+    properties_cache.put(lang, _page_title(page), stored_props)
 
-# Perform query to Wikipedia API with given parameters
+# Follow known redirects for uri (keeping section fragment)
 
-def _request(endpoint, params, callback, user_data):
+def resolve_uri(uri):
+  base_uri, fragment = urllib.parse.urldefrag(uri)
+
+  visited = [base_uri]
+  for i in range(3):
+    target_uri = redirect_map.get(base_uri)
+    if not target_uri or target_uri in visited:
+      break
+    base_uri = target_uri
+    visited.append(base_uri)
+
+  if fragment:
+    return base_uri + '#' + fragment
+  else:
+    return base_uri
+
+# Add redirect from source uri to target uri (replacing the reverse one)
+
+def add_redirect(source_uri, target_uri):
+  if source_uri == target_uri:
+    return
+
+  if redirect_map.get(target_uri) == source_uri:
+    redirect_map.remove(target_uri)
+  redirect_map.put(source_uri, target_uri)
+
+# Get article uri for host and title
+
+def get_title_uri(host, title):
+  return 'https://' + host + '/wiki/' + urllib.parse.quote(title.replace(' ', '_'), safe='/:;@$!*(),~')
+
+# Get Soup session, creating it and following network availability on first
+# use (so processes that don't go online don't pay for it)
+
+def get_session():
   global session
 
+  if session is None:
+    session = Soup.Session.new()
+    session.set_user_agent('Wike/3.2.1 (https://github.com/hugolabe)')
+    scheduler.watch_network(Gio.NetworkMonitor.get_default())
+
+  return session
+
+# Open connection to Wikipedia host in advance (DNS, TCP and TLS)
+
+def preconnect(lang):
+  host = lang + '.wikipedia.org'
+  now = time.monotonic()
+  if host in _preconnected and now - _preconnected[host] < _preconnect_ttl:
+    return
+
+  _preconnected[host] = now
+  message = Soup.Message.new('HEAD', 'https://' + host + '/w/api.php')
+  get_session().preconnect_async(message, GLib.PRIORITY_LOW, None, _on_preconnect_finished, None)
+
+# Remove cached responses for a language (all languages if none)
+
+def invalidate_cache(lang=None):
+  if lang:
+    response_cache.invalidate('https://' + lang + '.wikipedia.org/')
+  else:
+    response_cache.invalidate()
+
+# Check if network is available (requests are queued while not)
+
+def is_online():
+  return scheduler.online
+
+# Change priority of queued requests for a cancellable
+
+def set_priority(cancellable, priority):
+  scheduler.reprioritize(cancellable, priority)
+
+# Get counters for requests sent, requests coalesced, decoding time,
+# response cache and summary of last requests by language and action
+
+def get_stats():
+  stats = dict(_counters)
+  stats['cache'] = response_cache.stats()
+  stats['requests'] = request_log.summary()
+  return stats
+
+# Get summary of last requests as text table followed by request counters,
+# decoding times, response cache counters and main loop lag
+
+def format_request_stats():
+  cache_stats = response_cache.stats()
+  if _decode_inline:
+    decode_mode = 'main loop'
+  else:
+    decode_mode = 'worker pool'
+
+  lines = [request_log.format_summary(),
+           '',
+           'requests sent %d, coalesced %d (saved)' % (_counters['sent'], _counters['coalesced']),
+           'decoding in %s: %.1f ms in main loop, %.1f ms in workers, callbacks %.1f ms' % (decode_mode,
+                                                                                         _counters['decode_main_ms'],
+                                                                                         _counters['decode_worker_ms'],
+                                                                                         _counters['callback_ms']),
+           'response cache hits %d, stale hits %d, misses %d, %d entries, %.1f kB' % (cache_stats['hits'],
+                                                                                   cache_stats['stale_hits'],
+                                                                                   cache_stats['misses'],
+                                                                                   cache_stats['entries'],
+                                                                                   cache_stats['bytes'] / 1024)]
+
+  if loop_lag.is_running():
+    lines.append(loop_lag.format_summary())
+  else:
+    lines.append('main loop lag not measured (set WIKE_REQUEST_STATS=1)')
+
+  return '\n'.join(lines)
+
+# Perform async query to Wikipedia API with given parameters
+# Callbacks receive the response decoded and shaped off the main loop
+# (or the exception raised) and user data, and are not called if request is
+# cancelled. Identical requests attach to the one in flight and share
+# its response, and are queued in scheduler with given priority (owner
+# for priority changes is the cancellable unless given)
+
+def _request(endpoint, params, callback, user_data, cancellable=None, priority=PRIORITY_FOREGROUND, shape=None, owner=None):
+  if not owner:
+    owner = cancellable
+
   params_encoded = urllib.parse.urlencode(params, safe='%=&|')
+  cache_key = _cache_key(endpoint, params)
+  cache_ttl = _cache_ttl(params)
+  record = RequestRecord(endpoint, params)
+
+  if cache_ttl:
+    data = response_cache.get(cache_key)
+    if data:
+      record.cache = 'hit'
+      record.finish(Soup.Status.OK, len(data))
+      request_log.add(record)
+      _decode_async(data, shape, _finish_single, (callback, user_data, cancellable))
+      return
+
+  if cache_ttl and cache_key in _in_flight:
+    flight = _in_flight[cache_key]
+    flight.add(callback, user_data, cancellable)
+    flight.job.add_owner(owner, priority)
+    record.cache = 'coalesced'
+    flight.records.append(record)
+    _counters['coalesced'] += 1
+    return
+
+  flight = InFlightRequest(cache_key)
+  flight.add(callback, user_data, cancellable)
+  flight.records.append(record)
+  if cache_ttl:
+    _in_flight[cache_key] = flight
+
+  host = urllib.parse.urlparse(endpoint).netloc
+  request_data = (endpoint, params_encoded, cache_key, cache_ttl, shape, flight)
+  flight.job = RequestJob(host, _start_request, request_data, flight.cancellable)
+  flight.job.add_owner(owner, priority)
+  get_session()
+  scheduler.submit(flight.job)
+
+# Get rich search results from suggestions cache if fresh (or stale if
+# allowed, revalidated in background) or search them
+
+def _search_rich(text, lang, limit, cancellable, priority, timeout, stale=False):
+  stored = suggestion_cache.get(lang, text, limit)
+  if stored:
+    results, age = stored
+    if age < _suggestion_ttl or stale:
+      future = Future(cancellable)
+      if future.done():
+        return future
+
+      if age >= _suggestion_ttl:
+        future.stale = True
+        future.revalidated = _search_prefix(text, lang, limit, None, PRIORITY_BACKGROUND, timeout)
+      future.set_result([SearchHit(*values) for values in results] or None)
+      return future
+
+  return _search_prefix(text, lang, limit, cancellable, priority, timeout, stale)
+
+# Search with prefix search query and store results in suggestions cache
+
+def _search_prefix(text, lang, limit, cancellable, priority, timeout, stale=False):
+  endpoint = 'https://' + lang + '.wikipedia.org/w/api.php'
+  params = _prefix_search_params(text, limit)
+  shape = functools.partial(_shape_prefix_search, lang=lang)
+
+  future = _request_future(endpoint, params, cancellable, priority, timeout, shape, stale)
+  future.add_done_callback(functools.partial(_on_prefix_search_finished, text, lang, limit))
+  return future
+
+# On prefix search finished store fresh results in suggestions cache
+
+def _on_prefix_search_finished(text, lang, limit, future):
+  if future.stale:
+    if future.revalidated:
+      future.revalidated.add_done_callback(functools.partial(_on_prefix_search_finished, text, lang, limit))
+    return
+
+  try:
+    hits = future.result()
+  except:
+    return
+
+  suggestion_cache.put(lang, text, limit, [hit.pack() for hit in hits or []])
+
+# Get params for prefix search with url, Wikidata item, description and
+# thumbnail of pages
+
+def _prefix_search_params(text, limit):
+  return { 'action': 'query',
+           'generator': 'prefixsearch',
+           'gpssearch': text,
+           'gpslimit': limit,
+           'gpsnamespace': 0,
+           'prop': 'info|pageprops|description|pageimages',
+           'inprop': 'url',
+           'ppprop': 'wikibase_item',
+           'piprop': 'thumbnail',
+           'pithumbsize': _thumbnail_size,
+           'pilimit': limit,
+           'redirects': 1,
+           'format': 'json',
+           'formatversion': 2 }
+
+# Perform async query and get future for its shaped result (on timeout the
+# future fails and its cancellable is cancelled). If stale results are
+# allowed an expired cached response is returned at once, and the request
+# is sent in background for the revalidated future
+
+def _request_future(endpoint, params, cancellable, priority, timeout, shape, stale=False):
+  future = Future(cancellable)
+  if future.done():
+    return future
+
+  if stale:
+    data = response_cache.get_stale(_cache_key(endpoint, params))
+    if data:
+      record = RequestRecord(endpoint, params)
+      record.cache = 'stale'
+      record.finish(Soup.Status.OK, len(data))
+      request_log.add(record)
+      future.stale = True
+      future.revalidated = _request_future(endpoint, params, None, PRIORITY_BACKGROUND, timeout, shape)
+      _decode_async(data, shape, _on_future_finished, future)
+      return future
+
+  _request(endpoint, params, _on_future_finished, future, future.cancellable, priority, shape, future.owner)
+  if timeout:
+    future.set_timeout(timeout)
+
+  return future
+
+# On async query finished set result or error of its future
+
+def _on_future_finished(result, future):
+  if isinstance(result, Exception):
+    future.set_error(result)
+  else:
+    future.set_result(result)
+
+# Request next part of batched query
+
+def _request_batch(batch, priority):
+  endpoint = 'https://' + batch['lang'] + '.wikipedia.org/w/api.php'
+  params = { 'action': 'query',
+             'prop': 'info',
+             'inprop': 'url',
+             'redirects': 1,
+             'titles': '|'.join(page for host, page in batch['pages']),
+             'format': 'json',
+             'formatversion': 2 }
+
+  _request(endpoint, params, _on_batch_finished, batch, None, priority, _shape_batch)
+
+# On batched query finished store properties and redirects from pages (on
+# the host each one was loaded from) to canonical titles
+
+def _on_batch_finished(result, batch):
+  try:
+    aliases, found = _unwrap(result)
+  except:
+    return
+
+  for host, page in batch['pages']:
+    title = urllib.parse.unquote(page)
+    for i in range(3):
+      if title in aliases:
+        title = aliases[title]
+    if title in found:
+      _prefetched[(batch['lang'], title)] = found[title]
+      add_redirect('https://' + host + '/wiki/' + page, get_title_uri(host, title))
+
+# Send async request when started by scheduler
+
+def _start_request(job):
+  endpoint, params_encoded, cache_key, cache_ttl, shape, flight = job.request_data
+
   message = Soup.Message.new_from_encoded_form('GET', endpoint, params_encoded)
+  message.add_flags(Soup.MessageFlags.COLLECT_METRICS)
+  _counters['sent'] += 1
+  flight.records[0].sent()
+  get_session().send_and_read_async(message, GLib.PRIORITY_DEFAULT, flight.cancellable, _on_request_finished, (message, job))
+
+# On request finished store response in cache and decode it for callbacks
+# (retry later if server asks to slow down)
+
+def _on_request_finished(session, async_result, request_data):
+  message, job = request_data
+  endpoint, params_encoded, cache_key, cache_ttl, shape, flight = job.request_data
 
-  if callback:
-    session.send_and_read_async(message, 0, None, callback, user_data)
+  try:
+    response = session.send_and_read_finish(async_result)
+  except:
+    response = None
+
+  status = message.get_status()
+  scheduler.finished(job, status, _get_retry_after(message))
+
+  if (status == 429 or status == 503) and job.retries < 2 and not job.is_cancelled():
+    job.retries += 1
+    scheduler.submit(job)
     return
+
+  if _in_flight.get(cache_key) is flight:
+    del _in_flight[cache_key]
+
+  if response is None:
+    data = None
+  else:
+    if status == Soup.Status.OK:
+      data = response.get_data()
+      if cache_ttl:
+        response_cache.put(cache_key, data, cache_ttl)
+    else:
+      data = None
+
+  if flight.cancellable.is_cancelled():
+    flight.records[0].cache = 'cancelled'
+  for record in flight.records:
+    _log_request(record, message)
+    if data:
+      record.size = len(data)
+
+  _decode_async(data, shape, _finish_flight, flight)
+
+# Finish request record with status and time to first byte and add it to
+# request log
+
+def _log_request(record, message):
+  record.finish(message.get_status(), 0)
+
+  metrics = message.get_metrics()
+  if metrics and metrics.get_response_start() and record.cache == 'miss':
+    record.ttfb = (metrics.get_response_start() - metrics.get_fetch_start()) / 1000
+
+  request_log.add(record)
+
+# On preconnect finished ignore errors (connection is made again if needed)
+
+def _on_preconnect_finished(session, async_result, user_data):
+  try:
+    session.preconnect_finish(async_result)
+  except:
+    pass
+
+# Get seconds to wait from Retry-After response header (0 if none)
+
+def _get_retry_after(message):
+  headers = message.get_response_headers()
+  if not headers:
+    return 0
+
+  try:
+    return min(int(headers.get_one('Retry-After')), 300)
+  except:
+    return 0
+
+# Decode response in worker pool and finish in main loop
+
+def _decode_async(data, shape, finish, finish_data):
+  if _decode_inline:
+    GLib.idle_add(_decode_idle, data, shape, finish, finish_data)
+  else:
+    _decode_pool.submit(_decode_worker, data, shape, finish, finish_data)
+
+# Decode response in worker thread
+
+def _decode_worker(data, shape, finish, finish_data):
+  start = time.monotonic()
+  result = _decode(data, shape)
+  elapsed = (time.monotonic() - start) * 1000
+
+  GLib.idle_add(_finish_decode, result, elapsed, finish, finish_data)
+
+# Decode response in main loop
+
+def _decode_idle(data, shape, finish, finish_data):
+  start = time.monotonic()
+  result = _decode(data, shape)
+  _counters['decode_main_ms'] += (time.monotonic() - start) * 1000
+
+  _finish_decode(result, 0, finish, finish_data)
+  return GLib.SOURCE_REMOVE
+
+# Run finish function with decoded result and count main loop time
+
+def _finish_decode(result, elapsed, finish, finish_data):
+  _counters['decode_worker_ms'] += elapsed
+
+  start = time.monotonic()
+  finish(result, finish_data)
+  _counters['callback_ms'] += (time.monotonic() - start) * 1000
+
+  return GLib.SOURCE_REMOVE
+
+# Run callbacks waiting for shared request
+
+def _finish_flight(result, flight):
+  flight.finish(result)
+
+# Run callback for single request (cached response)
+
+def _finish_single(result, waiter):
+  callback, user_data, cancellable = waiter
+  if not (cancellable and cancellable.is_cancelled()):
+    callback(result, user_data)
+
+# Get cache key from endpoint and normalized params
+
+def _cache_key(endpoint, params):
+  normalized = []
+  for name in sorted(params):
+    value = str(params[name])
+    if name == 'search' or name == 'gpssearch':
+      value = ' '.join(value.lower().split())
+    normalized.append((name, value))
+
+  return endpoint + '?' + urllib.parse.urlencode(normalized)
+
+# Get cache time to live for params (0 if response can't be cached)
+
+def _cache_ttl(params):
+  if params.get('generator') == 'random':
+    return 0
   else:
-    response = session.send_and_read(message, None)
+    return _cache_ttls.get(params['action'], 0)
+
+# Get normalized title from page path
+
+def _page_title(page):
+  return urllib.parse.unquote(page).replace('_', ' ')
+
+# Decode json response data and shape result (return exception if failed)
+
+def _decode(data, shape):
+  try:
+    if data is None:
+      raise ValueError('No response data')
+    result = json.loads(data)
+    if shape:
+      result = shape(result)
+  except Exception as error:
+    return error
+
+  return result
+
+# Get result or raise exception from failed request
+
+def _unwrap(result):
+  if isinstance(result, Exception):
+    raise result
+
+  return result
+
+# Get uri from random response
+
+def _shape_random(result):
+  page_props = result['query']['pages'][0]
+  return page_props['fullurl']
+
+# Get uris from random batch response
+
+def _shape_random_list(result):
+  return [page_props['fullurl'] for page_props in result['query']['pages']]
+
+# Get search hits from search response (None if no results)
 
-  if message.get_status() == Soup.Status.OK:
-    data = response.get_data()
-    return data
+def _shape_search(result):
+  if len(result[1]) > 0:
+    return [SearchHit(title, uri) for title, uri in zip(result[1], result[3])]
   else:
     return None
+
+# Get search hits ordered by relevance from prefix search response (None if
+# no results)
+
+def _shape_prefix_search(result, lang):
+  pages = result.get('query', {}).get('pages', [])
+  if len(pages) == 0:
+    return None
+
+  pages.sort(key=lambda page_props: page_props.get('index', len(pages)))
+
+  return [SearchHit(page_props['title'],
+                    page_props['fullurl'],
+                    lang,
+                    page_props.get('pageprops', {}).get('wikibase_item'),
+                    page_props.get('description'),
+                    page_props.get('thumbnail', {}).get('source')) for page_props in pages]
+
+# Get rich search hits by requested title from batched summaries response
+# (following normalized titles and redirects)
+
+def _shape_summaries(result, titles, lang):
+  query = result.get('query', {})
+
+  aliases = {}
+  for alias in query.get('normalized', []) + query.get('redirects', []):
+    aliases[alias['from']] = alias['to']
+
+  hits = {}
+  for page_props in query.get('pages', []):
+    if page_props.get('missing') or page_props.get('invalid'):
+      continue
+    hits[page_props['title']] = SearchHit(page_props['title'],
+                                          page_props['fullurl'],
+                                          lang,
+                                          None,
+                                          page_props.get('description'),
+                                          page_props.get('thumbnail', {}).get('source'))
+
+  summaries = {}
+  for title in titles:
+    found = aliases.get(title, title)
+    found = aliases.get(found, found)
+    if found in hits:
+      summaries[title] = hits[found]
+
+  return summaries
+
+# Get title, revision id and sections from parse response
+
+def _shape_properties(result):
+  parse = result['parse']
+  sections = [Section(section['line'], section['anchor'], section['toclevel']) for section in parse['sections']]
+
+  return { 'title': parse['title'],
+           'revid': parse.get('revid'),
+           'sections': sections }
+
+# Get language links from list of langlink objects
+
+def _shape_langlinks_list(langlinks):
+  return [LangLink(langlink['lang'], langlink['title'], langlink['url'], langlink['autonym']) for langlink in langlinks]
+
+# Get title aliases and page properties from batched query response
+
+def _shape_batch(result):
+  query = result.get('query', {})
+
+  aliases = {}
+  for alias in query.get('normalized', []) + query.get('redirects', []):
+    aliases[alias['from']] = alias['to']
+
+  found = {}
+  for page_props in query.get('pages', []):
+    if page_props.get('missing') or page_props.get('invalid'):
+      continue
+    found[page_props['title']] = { 'title': page_props['title'],
+                                   'revid': page_props.get('lastrevid'),
+                                   'url': page_props.get('fullurl'),
+                                   'sections': None,
+                                   'langlinks': None }
+
+  return aliases, found
+
+# Get language links from parse response
+
+def _shape_langlinks(result):
+  return _shape_langlinks_list(result['parse']['langlinks'])
+
+# Get last revision id from info response
+
+def _shape_revision(result):
+  page_props = result['query']['pages'][0]
+  return page_props.get('lastrevid')
+
+
+# Section in table of contents of article
+
+class Section:
+
+  __slots__ = ('line', 'anchor', 'level')
+
+  # Set values
+
+  def __init__(self, line, anchor, level):
+    self.line = line
+    self.anchor = anchor
+    self.level = level
+
+  # Get values as list for storage
+
+  def pack(self):
+    return [self.line, self.anchor, self.level]
+
+
+# Link to article in other language
+
+class LangLink:
+
+  __slots__ = ('lang', 'title', 'url', 'autonym')
+
+  # Set values
+
+  def __init__(self, lang, title, url, autonym):
+    self.lang = lang
+    self.title = title
+    self.url = url
+    self.autonym = autonym
+
+  # Get values as list for storage
+
+  def pack(self):
+    return [self.lang, self.title, self.url, self.autonym]
+
+
+# Article found in search (language, Wikidata item, description and
+# thumbnail url only for rich results)
+
+class SearchHit:
+
+  __slots__ = ('title', 'uri', 'lang', 'item', 'description', 'thumbnail')
+
+  # Set values
+
+  def __init__(self, title, uri, lang=None, item=None, description=None, thumbnail=None):
+    self.title = title
+    self.uri = uri
+    self.lang = lang
+    self.item = item
+    self.description = description
+    self.thumbnail = thumbnail
+
+  # Get values as list for storage
+
+  def pack(self):
+    return [self.title, self.uri, self.lang, self.item, self.description, self.thumbnail]
+
+
+# Async request shared by callers waiting for the same response
+
+class InFlightRequest:
+
+  # Set key and cancellable for shared request
+
+  def __init__(self, key):
+    self.key = key
+    self.waiters = []
+    self.records = []
+    self.cancellable = Gio.Cancellable()
+    self.job = None
+
+  # Attach callback (skipped if caller cancellable is already cancelled).
+  # Cancelled signal is connected and disconnected as GObject signal, since
+  # Gio.Cancellable methods with the same names wait for running handlers
+
+  def add(self, callback, user_data, cancellable):
+    if cancellable and cancellable.is_cancelled():
+      return
+
+    waiter = [callback, user_data, cancellable, 0]
+    if cancellable:
+      waiter[3] = GObject.Object.connect(cancellable, 'cancelled', self._waiter_cancelled_cb, waiter)
+    self.waiters.append(waiter)
+
+  # Run callbacks of waiters with decoded result
+
+  def finish(self, result):
+    waiters = self.waiters
+    self.waiters = []
+
+    for callback, user_data, cancellable, handler in waiters:
+      if cancellable:
+        GObject.signal_handler_disconnect(cancellable, handler)
+      callback(result, user_data)
+
+  # On waiter cancelled detach it and cancel request if nobody waits
+
+  def _waiter_cancelled_cb(self, cancellable, waiter):
+    if waiter in self.waiters:
+      self.waiters.remove(waiter)
+      GObject.signal_handler_disconnect(cancellable, waiter[3])
+
+    if len(self.waiters) == 0:
+      if _in_flight.get(self.key) is self:
+        del _in_flight[self.key]
+      self.cancellable.cancel()
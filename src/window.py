@@ -3,11 +3,12 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 
-import os
+import os, urllib.parse
 
 from gi.repository import GLib, Gio, Gdk, Gtk, Adw, WebKit
 
-from wike.data import settings
+from wike import wikipedia
+from wike.data import settings, languages
 from wike.bookmarks import BookmarksPanel
 from wike.history import HistoryPanel
 from wike.langlinks import LanglinksPanel
@@ -15,6 +16,7 @@ from wike.menu import ArticleMenuPopover, MainMenuPopover, ViewMenuPopover
 from wike.page import PageBox
 from wike.search import SearchPanel
 from wike.toc import TocPanel
+from wike.view import preconnect
 
 
 # Main window
@@ -127,10 +129,13 @@ class Window(Adw.ApplicationWindow):
             self.tabview.set_selected_page(tabpage)
             self.page = tabpage.get_child()
             self.page.load_now()
+          self._prefetch_lazy_pages()
         else:
           tabpage = self.tabview.append(self.page)
           self.page.wikiview.load_message('blank')
 
+    self.page.wikiview.set_foreground(True)
+
     settings.bind('panel-pinned', self.panel_button, 'active', Gio.SettingsBindFlags.DEFAULT)
     settings.bind('panel-page', self.panel_stack, 'visible-child-name', Gio.SettingsBindFlags.DEFAULT)
 
@@ -164,6 +169,39 @@ class Window(Adw.ApplicationWindow):
     if settings.get_boolean('hide-tabs'):
       self._hide_tabs(True)
 
+    GLib.idle_add(self._preconnect_idle_cb, priority=GLib.PRIORITY_LOW)
+
+  # When idle warm up connections for search language and user languages
+
+  def _preconnect_idle_cb(self):
+    langs = [settings.get_string('search-language')]
+    for lang in languages.items:
+      if not lang in langs:
+        langs.append(lang)
+
+    preconnect(langs[:8])
+    wikipedia.refill_random(langs[0])
+    return GLib.SOURCE_REMOVE
+
+  # Prefetch properties for lazy-loading tabs in batches by language
+
+  def _prefetch_lazy_pages(self):
+    lazy_pages = {}
+    for i_page in range(self.tabview.get_n_pages()):
+      page = self.tabview.get_nth_page(i_page).get_child()
+      if not page.lazy_load:
+        continue
+
+      uri_elements = urllib.parse.urlparse(page.lazy_load[0])
+      uri_netloc = uri_elements[1]
+      uri_path = uri_elements[2]
+      if uri_netloc.endswith('.wikipedia.org') and uri_path.startswith('/wiki/'):
+        lang = uri_netloc.split('.', 1)[0]
+        lazy_pages.setdefault(lang, []).append((uri_netloc, uri_path.replace('/wiki/', '', 1)))
+
+    for lang, pages in lazy_pages.items():
+      wikipedia.prefetch_properties(pages, lang)
+
   # Set actions for window
 
   def _set_actions(self, app):
@@ -452,7 +490,9 @@ class Window(Adw.ApplicationWindow):
     if not tabpage:
       return
 
+    self.page.wikiview.set_foreground(False)
     self.page = tabpage.get_child()
+    self.page.wikiview.set_foreground(True)
     if self.page.lazy_load:
       self.page.load_now()
     else:
@@ -468,6 +508,7 @@ class Window(Adw.ApplicationWindow):
   def _tabview_close_page_cb(self, tabview, tabpage):
     page = tabpage.get_child()
     wikiview = page.wikiview
+    wikiview.cancel_properties()
 
     if self.tabview.get_n_pages() > 1:
       page.view_stack.remove(wikiview)
@@ -503,7 +544,7 @@ class Window(Adw.ApplicationWindow):
 
   def _add_bookmark_cb(self, action, parameter):
     if not self.page.wikiview.is_local():
-      uri = self.page.wikiview.get_base_uri()
+      uri = self.page.wikiview.get_canonical_uri()
       title = self.page.wikiview.title
       lang = self.page.wikiview.get_lang()
       if self.bookmarks_panel.add_bookmark(uri, title, lang):